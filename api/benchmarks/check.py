@@ -0,0 +1,144 @@
+import argparse
+import os
+import sys
+import warnings
+
+from pathlib import Path
+
+# Source of the API, set DIVERSIFY_SRC=/app in the api container
+sys.path.insert(
+    0,
+    os.environ.get(
+        "DIVERSIFY_SRC", str(Path(__file__).resolve().parents[1] / "src")
+    ),
+)
+
+import numpy as np
+
+from scipy.optimize import Bounds, minimize
+
+from generate import generate_portfolio
+from optimization.utils import (
+    compile_portfolio,
+    create_optimization_constraints,
+    run_optimization,
+    score_function,
+    score_gradient,
+)
+
+
+ASSET_CLASSES = ["Class A", "Class B", "Class C"]
+
+
+def reference_solve(
+    portfolio,
+    constraints: list[dict],
+    total_amount: float,
+    bounds: Bounds,
+) -> tuple[float, np.ndarray]:
+    # Plain SLSQP on the shares of the amount, none of the fast paths
+    scale = total_amount if total_amount > 0 else 1
+    constraint = create_optimization_constraints(
+        constraints, portfolio, total_amount
+    )
+    constraint.lb, constraint.ub = constraint.lb / scale, constraint.ub / scale
+    start = np.clip(
+        np.full(portfolio.n_assets, 1 / portfolio.n_assets),
+        bounds.lb / scale,
+        bounds.ub / scale,
+    )
+    res = minimize(
+        lambda share: score_function(scale * share, portfolio),
+        start,
+        jac=lambda share: scale * score_gradient(scale * share, portfolio),
+        method="SLSQP",
+        bounds=Bounds(bounds.lb / scale, bounds.ub / scale),
+        constraints=[constraint],
+        options={"ftol": 1e-12, "maxiter": 1000},
+    )
+    return score_function(scale * res.x, portfolio), scale * res.x
+
+
+def make_bounds(
+    rng: np.random.Generator, n_assets: int, total_amount: float
+) -> Bounds:
+    # Some assets get a minimum transfer, others a cap, always feasible
+    lower = np.where(
+        rng.random(n_assets) < 0.3,
+        rng.uniform(0, total_amount / (2 * n_assets), n_assets),
+        0.0,
+    )
+    upper = np.where(
+        rng.random(n_assets) < 0.4,
+        lower + rng.uniform(0, total_amount / (4 * n_assets), n_assets),
+        np.inf,
+    )
+    if np.all(np.isfinite(upper)):
+        upper[rng.integers(n_assets)] = np.inf
+    return Bounds(lower, upper)
+
+
+def check_case(
+    seed: int, bounded: bool, tolerance: float
+) -> tuple[float, float] | None:
+    rng = np.random.default_rng(seed)
+    n_assets = int(rng.integers(2, 13))
+    assets, allocation, _ = generate_portfolio(
+        n_assets, 0, ASSET_CLASSES, seed
+    )
+    portfolio = compile_portfolio(assets, allocation)
+    total_amount = float(rng.integers(100, 50_000))
+    bounds = make_bounds(rng, n_assets, total_amount) if bounded else None
+
+    result = run_optimization(portfolio, [], total_amount, bounds=bounds)
+    bounds = bounds or Bounds(np.zeros(n_assets), np.full(n_assets, np.inf))
+    reference, _ = reference_solve(portfolio, [], total_amount, bounds)
+
+    transfer = result.x
+    score = score_function(transfer, portfolio)
+    feasible = (
+        abs(np.sum(transfer) - total_amount) <= 1e-3 * total_amount
+        and np.all(transfer >= bounds.lb - 1e-6 * total_amount)
+        and np.all(transfer <= bounds.ub + 1e-6 * total_amount)
+    )
+    if (
+        not result.success
+        or not feasible
+        or score > reference + tolerance * max(reference, 1)
+    ):
+        return score, reference
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the optimizer against a plain SLSQP solve"
+    )
+    parser.add_argument("--cases", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1e-3,
+        help="Relative score excess over the reference that fails a case",
+    )
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    failures = 0
+    for seed in range(args.seed, args.seed + args.cases):
+        for bounded in (False, True):
+            failure = check_case(seed, bounded, args.tolerance)
+            if failure is not None:
+                failures += 1
+                print(
+                    f"seed {seed} {'bounded' if bounded else 'default'}: "
+                    f"score {failure[0]:.4f}, reference {failure[1]:.4f}"
+                )
+
+    print(f"{failures} failures out of {2 * args.cases} cases")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
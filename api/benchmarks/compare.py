@@ -0,0 +1,47 @@
+import argparse
+import json
+import sys
+
+
+def load_results(path: str) -> dict[tuple[str, int], dict]:
+    with open(path, "r") as f:
+        results = json.load(f)["results"]
+    return {
+        (result["benchmark"], result["n_assets"]): result for result in results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare two benchmark runs, fails on regressions"
+    )
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative slowdown of the median over which to fail",
+    )
+    args = parser.parse_args()
+
+    baseline = load_results(args.baseline)
+    candidate = load_results(args.candidate)
+
+    regressions = 0
+    for key in sorted(baseline.keys() & candidate.keys()):
+        before, after = baseline[key]["median"], candidate[key]["median"]
+        ratio = after / before if before > 0 else float("inf")
+        regression = ratio > 1 + args.threshold
+        regressions += regression
+        print(
+            f"{key[0]:<40} {key[1]:>6} assets "
+            f"{before * 1000:>10.2f} ms -> {after * 1000:>10.2f} ms "
+            f"x{ratio:.2f}{' REGRESSION' if regression else ''}"
+        )
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
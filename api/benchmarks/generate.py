@@ -0,0 +1,68 @@
+import numpy as np
+
+
+def generate_portfolio(
+    n_assets: int,
+    n_constraints: int,
+    asset_classes: list[str],
+    seed: int = 0,
+) -> tuple[list[dict], list[dict], list[dict]]:
+    # Synthetic assets, allocation and constraints shaped like the documents
+    # stored in Mongo, the same seed always gives the same portfolio
+    rng = np.random.default_rng(seed)
+    n_classes = len(asset_classes)
+
+    # Every class gets at least one asset when there are enough of them
+    class_indices = np.concatenate(
+        [
+            np.arange(min(n_assets, n_classes)),
+            rng.integers(0, n_classes, max(n_assets - n_classes, 0)),
+        ]
+    )
+    assets = [
+        {
+            "name": f"Asset {i}",
+            "class_name": asset_classes[class_index],
+            "value": float(rng.integers(0, 10_000)),
+        }
+        for i, class_index in enumerate(class_indices)
+    ]
+
+    allocation = [
+        {"object_type": "asset_class", "object_name": name, "rate": rate}
+        for name, rate in zip(
+            asset_classes, rng.dirichlet(np.ones(n_classes)).tolist()
+        )
+    ]
+    for asset_class in asset_classes:
+        class_assets = [
+            asset for asset in assets if asset["class_name"] == asset_class
+        ]
+        rates = rng.dirichlet(np.ones(len(class_assets))).tolist()
+        allocation += [
+            {
+                "object_type": "asset",
+                "object_name": asset["name"],
+                "rate": rate,
+            }
+            for asset, rate in zip(class_assets, rates)
+        ]
+
+    constraints = []
+    for _ in range(n_constraints):
+        size = int(rng.integers(1, min(4, n_assets) + 1))
+        constraints.append(
+            {
+                "assets": [
+                    {
+                        "asset_name": assets[i]["name"],
+                        "coef": float(rng.choice([1.0, 2.0])),
+                    }
+                    for i in rng.choice(n_assets, size, replace=False)
+                ],
+                "operator": "leq",
+                "value": float(rng.integers(1_000, 10_000)),
+            }
+        )
+
+    return assets, allocation, constraints
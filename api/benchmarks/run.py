@@ -0,0 +1,318 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import warnings
+
+from pathlib import Path
+
+# Source of the API, set DIVERSIFY_SRC=/app in the api container
+sys.path.insert(
+    0,
+    os.environ.get(
+        "DIVERSIFY_SRC", str(Path(__file__).resolve().parents[1] / "src")
+    ),
+)
+
+import numpy as np
+import yaml
+
+from check import reference_solve
+from generate import generate_portfolio
+from scipy.optimize import Bounds
+from optimization.utils import (
+    compile_portfolio,
+    create_optimization_constraints,
+    format_result,
+    run_optimization,
+    score_function,
+)
+
+
+with open("/conf/project_config.yml", "r") as f:
+    PROJECT_CONFIG = yaml.safe_load(f)
+
+ASSET_CLASSES = PROJECT_CONFIG.get("config", {}).get("asset_classes")
+
+
+def measure(function, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {
+        "repeat": repeat,
+        "min": min(timings),
+        "median": statistics.median(timings),
+    }
+
+
+def report(result: dict):
+    print(
+        f"{result['benchmark']:<40} {result['n_assets']:>6} assets "
+        f"{result['median'] * 1000:>10.2f} ms"
+        f"{'' if result.get('matches_reference', True) else ' MISMATCH'}",
+        file=sys.stderr,
+    )
+
+
+def compare_to_reference(
+    portfolio, constraints: list[dict], total_amount: int, tolerance: float
+) -> dict:
+    # The optimized solvers must do at least as well as a plain SLSQP solve
+    score = score_function(
+        run_optimization(portfolio, constraints, total_amount).x, portfolio
+    )
+    bounds = Bounds(
+        np.zeros(portfolio.n_assets), np.full(portfolio.n_assets, np.inf)
+    )
+    reference, _ = reference_solve(
+        portfolio, constraints, total_amount, bounds
+    )
+    return {
+        "score": score,
+        "reference_score": reference,
+        "matches_reference": bool(
+            score <= reference + tolerance * max(reference, 1)
+        ),
+    }
+
+
+def benchmark_optimizer(
+    sizes: list[int],
+    n_constraints: int,
+    total_amount: int,
+    repeat: int,
+    max_constrained_size: int,
+    max_reference_size: int,
+    tolerance: float,
+    seed: int,
+) -> list[dict]:
+    results = []
+    for n_assets in sizes:
+        assets, allocation, constraints = generate_portfolio(
+            n_assets, n_constraints, ASSET_CLASSES, seed
+        )
+        portfolio = compile_portfolio(assets, allocation)
+        transfer = run_optimization(portfolio, [], total_amount).x
+
+        benchmarks = {
+            "score_function": lambda: score_function(transfer, portfolio),
+            "create_optimization_constraints": (
+                lambda: create_optimization_constraints(
+                    constraints, portfolio, total_amount
+                )
+            ),
+            "run_optimization": lambda: run_optimization(
+                portfolio, [], total_amount
+            ),
+            "format_result": lambda: format_result(transfer, portfolio),
+        }
+        # SLSQP does not scale to the largest portfolios
+        if n_assets <= max_constrained_size:
+            benchmarks[
+                "run_optimization_constrained"
+            ] = lambda: run_optimization(portfolio, constraints, total_amount)
+
+        for name, function in benchmarks.items():
+            result = {
+                "benchmark": name,
+                "n_assets": n_assets,
+                "n_constraints": n_constraints,
+                **measure(function, repeat),
+            }
+            if name.startswith("run_optimization") and (
+                n_assets <= max_reference_size
+            ):
+                result.update(
+                    compare_to_reference(
+                        portfolio,
+                        constraints if name.endswith("constrained") else [],
+                        total_amount,
+                        tolerance,
+                    )
+                )
+            report(result)
+            results.append(result)
+    return results
+
+
+def benchmark_api(
+    sizes: list[int],
+    n_constraints: int,
+    total_amount: int,
+    repeat: int,
+    max_constrained_size: int,
+    seed: int,
+) -> list[dict]:
+    # The app runs in process, against an in-memory stand-in for Mongo
+    import motor.motor_asyncio
+
+    from mongomock_motor import AsyncMongoMockClient
+
+    motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+
+    from fastapi.testclient import TestClient
+    from main import app
+
+    results = []
+    with TestClient(app) as client:
+        for n_assets in sizes:
+            assets, allocation, constraints = generate_portfolio(
+                n_assets, n_constraints, ASSET_CLASSES, seed
+            )
+            if n_assets > max_constrained_size:
+                constraints = []
+            client.cookies.set("session_id", f"benchmark-{n_assets}")
+            data = {
+                "assets": assets,
+                "allocation": allocation,
+                "constraints": constraints,
+            }
+            values = {
+                "assets": [
+                    {"name": asset["name"], "value": asset["value"] + 1}
+                    for asset in assets
+                ]
+            }
+            # A new amount for every call, so that no result is cached
+            amounts = iter(range(total_amount, total_amount + repeat + 1))
+
+            benchmarks = {
+                "POST /mongo/import": lambda: client.post(
+                    "/mongo/import", json=data
+                ),
+                "GET /assets/": lambda: client.get("/assets/"),
+                "GET /portfolio/": lambda: client.get("/portfolio/"),
+                "GET /assets/summary": lambda: client.get("/assets/summary"),
+                "POST /assets/batch": lambda: client.post(
+                    "/assets/batch", json=values
+                ),
+                "GET /mongo/export": lambda: client.get("/mongo/export"),
+                "GET /optimization/": lambda: client.get(
+                    "/optimization/",
+                    params={"total_amount": next(amounts)},
+                ),
+            }
+            for name, function in benchmarks.items():
+                response = function()
+                if not response.is_success:
+                    raise RuntimeError(f"{name} failed: {response.text}")
+                result = {
+                    "benchmark": name,
+                    "n_assets": n_assets,
+                    "n_constraints": len(constraints),
+                    **measure(function, repeat),
+                }
+                report(result)
+                results.append(result)
+    return results
+
+
+def get_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the optimizer and the API on synthetic portfolios"
+    )
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000]
+    )
+    parser.add_argument("--constraints", type=int, default=5)
+    parser.add_argument("--total-amount", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-constrained-size", type=int, default=1000)
+    parser.add_argument(
+        "--max-reference-size",
+        type=int,
+        default=1000,
+        help="Largest portfolio whose scores are checked against SLSQP",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1e-3,
+        help="Relative score excess over the reference that fails a check",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-api", action="store_true")
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    parameters = {
+        "sizes": args.sizes,
+        "n_constraints": args.constraints,
+        "total_amount": args.total_amount,
+        "repeat": args.repeat,
+        "max_constrained_size": args.max_constrained_size,
+        "max_reference_size": args.max_reference_size,
+        "tolerance": args.tolerance,
+        "seed": args.seed,
+    }
+    results = benchmark_optimizer(
+        args.sizes,
+        args.constraints,
+        args.total_amount,
+        args.repeat,
+        args.max_constrained_size,
+        args.max_reference_size,
+        args.tolerance,
+        args.seed,
+    )
+    if not args.skip_api:
+        results += benchmark_api(
+            args.sizes,
+            args.constraints,
+            args.total_amount,
+            args.repeat,
+            args.max_constrained_size,
+            args.seed,
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "commit": get_commit(),
+                "date": datetime.datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "parameters": parameters,
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+
+    mismatches = [
+        result
+        for result in results
+        if not result.get("matches_reference", True)
+    ]
+    for result in mismatches:
+        print(
+            f"{result['benchmark']} with {result['n_assets']} assets scores "
+            f"{result['score']:.6f}, plain SLSQP {result['reference_score']:.6f}",
+            file=sys.stderr,
+        )
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
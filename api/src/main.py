@@ -1,8 +1,17 @@
 import random
 
 from fastapi import Cookie, FastAPI, Request
-from mongo import allocation, assets, constraints, database
-from optimization import optimization
+from metrics import metrics_router, time_request
+from mongo import (
+    allocation,
+    assets,
+    changes,
+    constraints,
+    database,
+    portfolio,
+    reaper,
+)
+from optimization import jobs, optimization
 
 
 app = FastAPI()
@@ -12,11 +21,40 @@ app.include_router(allocation.allocation_router)
 app.include_router(constraints.constraints_router)
 app.include_router(optimization.optimization_router)
 app.include_router(database.mongo_router)
+app.include_router(portfolio.portfolio_router)
+app.include_router(changes.changes_router)
+app.include_router(metrics_router)
+
+
+@app.on_event("startup")
+async def open_mongo_client():
+    database.connect_mongo()
+    database.start_index_backfill()
+    database.start_activity_flusher()
+    reaper.start_reaper()
+    changes.start_compactor()
+    jobs.start_solver_pool()
+
+
+@app.on_event("shutdown")
+async def close_mongo_client():
+    jobs.stop_solver_pool()
+    database.stop_index_backfill()
+    reaper.stop_reaper()
+    changes.stop_compactor()
+    await database.stop_activity_flusher()
+    database.close_mongo()
 
 
 @app.middleware("http")
 async def process_session_cookie(request: Request, call_next):
     session_id = request.cookies.get("session_id")
+    if session_id:
+        database.record_access(session_id)
     response = await call_next(request)
     response.set_cookie(key="session_id", value=session_id)
     return response
+
+
+# Registered last, so that it also times the other middlewares
+app.middleware("http")(time_request)
@@ -0,0 +1,121 @@
+import logging
+import time
+
+from contextlib import contextmanager
+
+import yaml
+
+from fastapi import APIRouter, Request, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+from starlette.routing import Match
+
+
+with open("/conf/project_config.yml", "r") as f:
+    PROJECT_CONFIG = yaml.safe_load(f)
+
+SLOW_REQUEST_SECONDS = PROJECT_CONFIG.get("metrics", {}).get(
+    "slow_request_seconds", 2.0
+)
+
+metrics_router = APIRouter(tags=["metrics"])
+
+REQUEST_LATENCY = Histogram(
+    "diversify_request_duration_seconds",
+    "Time spent answering requests",
+    ["method", "route", "status"],
+)
+OPTIMIZATION_PHASE_LATENCY = Histogram(
+    "diversify_optimization_phase_duration_seconds",
+    "Time spent in each phase of an optimization",
+    ["phase"],
+)
+SOLVES = Counter(
+    "diversify_solves_total", "Solver runs", ["solver", "success"]
+)
+SOLVER_ITERATIONS = Counter(
+    "diversify_solver_iterations_total", "Solver iterations", ["solver"]
+)
+SOLVER_EVALUATIONS = Counter(
+    "diversify_solver_function_evaluations_total",
+    "Objective function evaluations",
+    ["solver"],
+)
+
+
+# Measures taken while solving, which happens in the solver processes, they
+# are sent back with the result and observed by the API process
+_records: list[tuple] = []
+
+
+@contextmanager
+def phase_timer(phase: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _records.append(("phase", phase, time.perf_counter() - start))
+
+
+def record_solve(solver: str, result):
+    _records.append(
+        (
+            "solve",
+            solver,
+            bool(result.success),
+            result.get("nit", 0),
+            result.get("nfev", 0),
+        )
+    )
+
+
+def collect_records() -> list[tuple]:
+    records = _records.copy()
+    _records.clear()
+    return records
+
+
+def observe_records(records: list[tuple]):
+    for record in records:
+        if record[0] == "phase":
+            _, phase, seconds = record
+            OPTIMIZATION_PHASE_LATENCY.labels(phase).observe(seconds)
+        else:
+            _, solver, success, iterations, evaluations = record
+            SOLVES.labels(solver, str(success).lower()).inc()
+            SOLVER_ITERATIONS.labels(solver).inc(iterations)
+            SOLVER_EVALUATIONS.labels(solver).inc(evaluations)
+
+
+def find_route(request: Request) -> str:
+    # Path templates rather than paths, to keep the number of series bounded
+    for route in request.app.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+async def time_request(request: Request, call_next) -> Response:
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+
+    REQUEST_LATENCY.labels(
+        request.method, find_route(request), response.status_code
+    ).observe(elapsed)
+    if elapsed > SLOW_REQUEST_SECONDS:
+        logging.warning(
+            f"Slow request {request.method} {request.url.path} for session "
+            f"{request.cookies.get('session_id')}: {elapsed:.2f} s"
+        )
+    return response
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+async def route_metrics() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,15 +1,21 @@
 import logging
 
-from json import loads
-
 import yaml
 
-from bson.json_util import dumps
-from fastapi import APIRouter, Cookie
-from pymongo.collection import Collection
-
-from .database import get_mongo_db
+from fastapi import APIRouter, Cookie, Depends
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.results import BulkWriteResult
+
+from .database import (
+    check_etag,
+    ensure_indexes,
+    get_session_collection,
+    record_changes,
+    write_in_batch,
+)
+from .layout import SessionCollection, make_update_one
 from .models import Allocation
+from .responses import MongoJSONResponse
 
 allocation_router = APIRouter(prefix="/allocation", tags=["allocation"])
 
@@ -18,87 +24,94 @@ with open("/conf/project_config.yml", "r") as f:
     PROJECT_CONFIG = yaml.safe_load(f)
 
 
-def get_allocation_collection(session_id: str) -> Collection:
-    db = get_mongo_db(session_id)
+def get_allocation_collection(
+    session_id: str,
+) -> AsyncIOMotorCollection | SessionCollection:
     allocation = PROJECT_CONFIG.get("mongodb", {}).get("allocation")
-    return db[allocation]
+    return get_session_collection(session_id, allocation)
 
 
-def existing_allocation_statement(
-    allocation_statement: dict, session_id: str
-) -> bool:
+async def upsert_allocation_statements(
+    allocation: list[dict], session_id: str
+) -> BulkWriteResult:
+    # Upserts relying on the unique object_name index, all sent at once
+    await ensure_indexes(session_id)
     allocation_collection = get_allocation_collection(session_id)
-    existing_asset = allocation_collection.find_one(
-        {"object_name": allocation_statement.get("object_name")}
+    object_names = [statement.get("object_name") for statement in allocation]
+    result = await write_in_batch(
+        allocation_collection,
+        [
+            make_update_one(
+                allocation_collection,
+                {"object_name": object_name},
+                {"$set": statement},
+                upsert=True,
+            )
+            for object_name, statement in zip(object_names, allocation)
+        ],
     )
-    if existing_asset:
-        return True
-    return False
-
-
-def create_allocation_statement(
-    allocation_statement: dict, session_id: str
-) -> str:
-    allocation_collection = get_allocation_collection(session_id)
-    allocation_statement_id = allocation_collection.insert_one(
-        allocation_statement
-    ).inserted_id
-    logging.info(f"Created allocation statement {allocation_statement_id}")
-    return allocation_statement_id
-
-
-def update_allocation_statement(
-    allocation_statement: dict, session_id: str
-) -> str:
-    allocation_collection = get_allocation_collection(session_id)
-    asset_id = allocation_collection.find_one_and_update(
-        {"object_name": allocation_statement.get("object_name")},
-        {"$set": {"rate": allocation_statement.get("rate")}},
+    written = await allocation_collection.find(
+        {"object_name": {"$in": object_names}}, {"_id": 1}
+    ).to_list(None)
+    await record_changes(
+        session_id,
+        "allocation",
+        [statement["_id"] for statement in written],
     )
-    return asset_id
+    logging.info(
+        f"Created {result.upserted_count} and updated "
+        f"{result.modified_count} allocation statements"
+    )
+    return result
 
 
-def delete_asset(allocation_statement: dict, session_id: str) -> str:
+async def delete_asset(allocation_statement: dict, session_id: str) -> str:
     allocation_collection = get_allocation_collection(session_id)
-    asset_id = allocation_collection.find_one_and_delete(
+    asset_id = await allocation_collection.find_one_and_delete(
         {"object_name": allocation_statement.get("object_name")}
     )
+    if asset_id:
+        await record_changes(
+            session_id, "allocation", [asset_id["_id"]], deleted=True
+        )
     return asset_id
 
 
-def find_allocation_statement(object_name: str, session_id: str) -> dict:
+async def find_allocation_statement(object_name: str, session_id: str) -> dict:
     allocation_collection = get_allocation_collection(session_id)
     query = {"object_name": object_name}
-    allocation_statement = allocation_collection.find_one(query)
+    allocation_statement = await allocation_collection.find_one(query)
     return allocation_statement
 
 
-@allocation_router.get("/")
-def route_get_allocation(session_id: str = Cookie()) -> dict:
+@allocation_router.get("/", response_class=MongoJSONResponse)
+async def route_get_allocation(
+    session_id: str = Cookie(),
+    headers: dict[str, str] = Depends(check_etag),
+) -> MongoJSONResponse:
     allocation_collection = get_allocation_collection(session_id)
-    allocation = list(allocation_collection.find())
-    allocation = [loads(dumps(statement)) for statement in allocation]
-    return {"allocation": allocation}
-
-
-@allocation_router.get("/find/{object_name}")
-def search_allocation_statement(
-    object_name: str, session_id: str = Cookie()
-) -> dict:
-    allocation_statement = find_allocation_statement(object_name, session_id)
-    allocation_statement = loads(dumps(allocation_statement))
-    return allocation_statement
+    allocation = await allocation_collection.find().to_list(None)
+    return MongoJSONResponse({"allocation": allocation}, headers=headers)
+
+
+@allocation_router.get("/find/{object_name}", response_class=MongoJSONResponse)
+async def search_allocation_statement(
+    object_name: str,
+    session_id: str = Cookie(),
+    headers: dict[str, str] = Depends(check_etag),
+) -> MongoJSONResponse:
+    allocation_statement = await find_allocation_statement(
+        object_name, session_id
+    )
+    return MongoJSONResponse(allocation_statement, headers=headers)
 
 
 @allocation_router.post("/")
-def route_set_allocation(
+async def route_set_allocation(
     allocation: Allocation, session_id: str = Cookie()
 ) -> dict:
     allocation = allocation.dict()["allocation"]
 
-    for statement in allocation:
-        if existing_allocation_statement(statement, session_id):
-            update_allocation_statement(statement, session_id)
-        else:
-            create_allocation_statement(statement, session_id)
+    if allocation:
+        await upsert_allocation_statements(allocation, session_id)
     return {"message": "Allocation statements finished."}
@@ -1,16 +1,25 @@
+import asyncio
 import logging
 
-from json import loads
 from typing import Optional
 
 import yaml
 
-from bson.json_util import dumps
-from fastapi import APIRouter, Cookie, HTTPException
-from pymongo.collection import Collection
+from fastapi import APIRouter, Cookie, Depends, HTTPException, Query
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ASCENDING, DESCENDING
+from pymongo.results import BulkWriteResult
 
-from .database import get_mongo_db
-from .models import Asset
+from .database import (
+    check_etag,
+    ensure_indexes,
+    get_session_collection,
+    record_changes,
+    write_in_batch,
+)
+from .layout import SessionCollection, make_update_one
+from .models import Asset, AssetValues
+from .responses import MongoJSONResponse
 
 assets_router = APIRouter(prefix="/assets", tags=["assets"])
 
@@ -18,46 +27,85 @@ assets_router = APIRouter(prefix="/assets", tags=["assets"])
 with open("/conf/project_config.yml", "r") as f:
     PROJECT_CONFIG = yaml.safe_load(f)
 
+SUMMARY_TOP_ASSETS = PROJECT_CONFIG.get("config", {}).get(
+    "summary_top_assets", 20
+)
 
-def get_assets_collection(session_id) -> Collection:
-    db = get_mongo_db(session_id)
+
+def get_assets_collection(
+    session_id,
+) -> AsyncIOMotorCollection | SessionCollection:
     assets = PROJECT_CONFIG.get("mongodb", {}).get("assets")
-    return db[assets]
+    return get_session_collection(session_id, assets)
 
 
-def existing_asset(asset: dict, session_id: str) -> bool:
+async def create_asset(asset: dict, session_id: str) -> str | None:
+    # Single upsert relying on the unique (name, class_name) index, returns
+    # None when the asset already exists
+    await ensure_indexes(session_id)
     assets_collection = get_assets_collection(session_id)
-    existing_asset = assets_collection.find_one(
-        {"name": asset.get("name"), "class_name": asset.get("class_name")}
+    result = await assets_collection.update_one(
+        {"name": asset.get("name"), "class_name": asset.get("class_name")},
+        {"$setOnInsert": asset},
+        upsert=True,
     )
-    if existing_asset:
-        return True
-    return False
-
-
-def create_asset(asset: dict, session_id: str) -> str:
-    assets_collection = get_assets_collection(session_id)
-    asset_id = assets_collection.insert_one(asset).inserted_id
-    logging.info(f"Created asset {asset_id}")
+    asset_id = result.upserted_id
+    if asset_id:
+        await record_changes(session_id, "assets", [asset_id])
+        logging.info(f"Created asset {asset_id}")
     return asset_id
 
 
-def update_asset_value(asset: dict, session_id: str) -> str:
+async def update_asset_value(asset: dict, session_id: str) -> str:
     assets_collection = get_assets_collection(session_id)
-    asset_id = assets_collection.find_one_and_update(
+    asset_id = await assets_collection.find_one_and_update(
         {"name": asset.get("name")},
         {"$set": {"value": asset.get("value")}},
     )
+    if asset_id:
+        await record_changes(session_id, "assets", [asset_id["_id"]])
     return asset_id
 
 
-def delete_asset(asset_name: str, session_id: str) -> str:
+async def update_asset_values(
+    assets: list[dict], session_id: str
+) -> BulkWriteResult:
+    assets_collection = get_assets_collection(session_id)
+    names = [asset.get("name") for asset in assets]
+    result = await write_in_batch(
+        assets_collection,
+        [
+            make_update_one(
+                assets_collection,
+                {"name": name},
+                {"$set": {"value": asset.get("value")}},
+            )
+            for name, asset in zip(names, assets)
+        ],
+    )
+    # The assets found are updated even when others are missing
+    updated = await assets_collection.find(
+        {"name": {"$in": names}}, {"_id": 1}
+    ).to_list(None)
+    await record_changes(
+        session_id, "assets", [asset["_id"] for asset in updated]
+    )
+    return result
+
+
+async def delete_asset(asset_name: str, session_id: str) -> str:
     assets_collection = get_assets_collection(session_id)
-    asset_id = assets_collection.find_one_and_delete({"name": asset_name})
+    asset_id = await assets_collection.find_one_and_delete(
+        {"name": asset_name}
+    )
+    if asset_id:
+        await record_changes(
+            session_id, "assets", [asset_id["_id"]], deleted=True
+        )
     return asset_id
 
 
-def search_asset(
+async def search_asset(
     name: Optional[str] = None,
     class_name: Optional[str] = None,
     session_id: str = None,
@@ -69,47 +117,120 @@ def search_asset(
     if class_name:
         query["class_name"] = class_name
 
-    assets = list(assets_collection.find(query))
+    assets = await assets_collection.find(query).to_list(None)
     return assets
 
 
-@assets_router.get("/")
-def route_get_assets(session_id: str = Cookie()) -> dict:
+async def summarize_assets(session_id: str, top: int) -> dict:
+    # Grouped by Mongo, then only the largest assets of each class are
+    # read, with one sorted query per class
     assets_collection = get_assets_collection(session_id)
-    assets = list(assets_collection.find())
-    assets = [loads(dumps(asset)) for asset in assets]
-    return {"assets": assets}
+    classes = await assets_collection.aggregate(
+        [
+            {
+                "$group": {
+                    "_id": "$class_name",
+                    "total": {"$sum": "$value"},
+                    "count": {"$sum": 1},
+                }
+            },
+            {
+                "$project": {
+                    "_id": 0,
+                    "class_name": "$_id",
+                    "total": 1,
+                    "count": 1,
+                }
+            },
+            {"$sort": {"class_name": 1}},
+        ]
+    ).to_list(None)
+    top_assets = await asyncio.gather(
+        *[
+            assets_collection.find(
+                {"class_name": asset_class["class_name"]},
+                {"_id": 0, "name": 1, "value": 1},
+                sort=[("value", DESCENDING), ("name", ASCENDING)],
+                limit=top,
+            ).to_list(None)
+            for asset_class in classes
+        ]
+    )
+    for asset_class, assets in zip(classes, top_assets):
+        # Assets stored without a value count as 0
+        asset_class["assets"] = [
+            {"name": asset["name"], "value": asset.get("value") or 0}
+            for asset in assets
+        ]
 
+    total = sum(asset_class["total"] for asset_class in classes)
+    for asset_class in classes:
+        class_total = asset_class["total"]
+        asset_class["share"] = class_total / total if total else 0
+        for asset in asset_class["assets"]:
+            asset["share"] = asset["value"] / class_total if class_total else 0
+        asset_class["other"] = {
+            "count": asset_class["count"] - len(asset_class["assets"]),
+            "total": class_total
+            - sum(asset["value"] for asset in asset_class["assets"]),
+        }
+    return {
+        "total": total,
+        "count": sum(asset_class["count"] for asset_class in classes),
+        "classes": classes,
+    }
 
-@assets_router.get("/search")
-def route_search_asset(
+
+@assets_router.get("/", response_class=MongoJSONResponse)
+async def route_get_assets(
+    session_id: str = Cookie(), headers: dict[str, str] = Depends(check_etag)
+) -> MongoJSONResponse:
+    assets_collection = get_assets_collection(session_id)
+    assets = await assets_collection.find().to_list(None)
+    return MongoJSONResponse({"assets": assets}, headers=headers)
+
+
+@assets_router.get("/search", response_class=MongoJSONResponse)
+async def route_search_asset(
     name: Optional[str] = None,
     class_name: Optional[str] = None,
     session_id: str = Cookie(),
-) -> dict:
-    assets = search_asset(name, class_name, session_id)
-    assets = [loads(dumps(asset)) for asset in assets]
-    return {"assets": assets}
+    headers: dict[str, str] = Depends(check_etag),
+) -> MongoJSONResponse:
+    assets = await search_asset(name, class_name, session_id)
+    return MongoJSONResponse({"assets": assets}, headers=headers)
+
+
+@assets_router.get("/summary", response_class=MongoJSONResponse)
+async def route_get_assets_summary(
+    top: int = Query(SUMMARY_TOP_ASSETS, gt=0),
+    session_id: str = Cookie(),
+    headers: dict[str, str] = Depends(check_etag),
+) -> MongoJSONResponse:
+    summary = await summarize_assets(session_id, top)
+    return MongoJSONResponse(summary, headers=headers)
 
 
 @assets_router.put("/")
-def route_create_asset(asset: Asset, session_id: str = Cookie()) -> dict:
+async def route_create_asset(asset: Asset, session_id: str = Cookie()) -> dict:
     asset = asset.dict()
-    if existing_asset(asset, session_id):
+    try:
+        asset_id = await create_asset(asset, session_id)
+    except AssertionError as exception:
+        raise HTTPException(status_code=400, detail=str(exception))
+    if not asset_id:
         raise HTTPException(
             status_code=400,
             detail=f"Asset {asset.get('name')} already exists",
         )
-    try:
-        asset_id = create_asset(asset, session_id)
-    except AssertionError as exception:
-        raise HTTPException(status_code=400, detail=str(exception))
     return {"asset_id": str(asset_id)}
 
 
 @assets_router.post("/")
-def route_update_asset_value(asset: dict, session_id: str = Cookie()) -> dict:
-    asset_id = update_asset_value(asset, session_id)
+async def route_update_asset_value(
+    asset: dict, session_id: str = Cookie()
+) -> dict:
+    asset_id = await update_asset_value(asset, session_id)
     if not asset_id:
         raise HTTPException(
             status_code=400,
@@ -119,9 +240,32 @@ def route_update_asset_value(asset: dict, session_id: str = Cookie()) -> dict:
     return {"asset_id": str(asset_id)}
 
 
+@assets_router.post("/batch")
+async def route_update_asset_values(
+    asset_values: AssetValues, session_id: str = Cookie()
+) -> dict:
+    assets = asset_values.dict()["assets"]
+    if not assets:
+        return {"matched": 0, "modified": 0}
+
+    result = await update_asset_values(assets, session_id)
+    if result.matched_count < len(assets):
+        raise HTTPException(
+            status_code=400,
+            detail=f"{len(assets) - result.matched_count} assets do not exist",
+        )
+    logging.info(f"Updated {result.modified_count} assets")
+    return {
+        "matched": result.matched_count,
+        "modified": result.modified_count,
+    }
+
+
 @assets_router.delete("/{asset_name}")
-def route_delete_asset(asset_name: str, session_id: str = Cookie()) -> dict:
-    asset_id = delete_asset(asset_name, session_id)
+async def route_delete_asset(
+    asset_name: str, session_id: str = Cookie()
+) -> dict:
+    asset_id = await delete_asset(asset_name, session_id)
     if not asset_id:
         raise HTTPException(
             status_code=400,
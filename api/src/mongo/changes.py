@@ -0,0 +1,190 @@
+import asyncio
+import datetime
+import logging
+
+from fastapi import APIRouter, Cookie, Query
+from pymongo import DESCENDING
+
+from .database import (
+    LAYOUT,
+    PROJECT_CONFIG,
+    connect_mongo,
+    get_session_collection,
+    get_shared_db,
+)
+from .migrate import SYSTEM_DATABASES
+from .responses import MongoJSONResponse
+
+changes_router = APIRouter(prefix="/changes", tags=["changes"])
+
+CHANGES_CONFIG = PROJECT_CONFIG.get("changes", {})
+
+# Collections of the session kept in sync, by the name used in the log
+SYNCED_COLLECTIONS = {
+    "assets": PROJECT_CONFIG.get("mongodb", {}).get("assets"),
+    "allocation": PROJECT_CONFIG.get("mongodb", {}).get("allocation"),
+    "constraints": "constraints",
+}
+
+_compactor: asyncio.Task | None = None
+
+
+async def load_documents(session_id: str, collection: str, query: dict):
+    return (
+        await get_session_collection(
+            session_id, SYNCED_COLLECTIONS[collection]
+        )
+        .find(query)
+        .to_list(None)
+    )
+
+
+async def load_changes(session_id: str, since: int) -> dict:
+    meta = (
+        await get_session_collection(session_id, "meta").find_one(
+            {},
+            {
+                "version": 1,
+                "changes_floor": 1,
+                "pending_writes": 1,
+                "settled_version": 1,
+                "last_write_date": 1,
+            },
+        )
+        or {}
+    )
+    version = meta.get("version", 0)
+    if since == 0 or since < meta.get("changes_floor", 0) or since > version:
+        # The client copy is missing, too old or from a session since
+        # reaped, it is replaced by every document
+        documents = await asyncio.gather(
+            *[
+                load_documents(session_id, collection, {})
+                for collection in SYNCED_COLLECTIONS
+            ]
+        )
+        return {
+            "version": version,
+            "reset": True,
+            "updated": dict(zip(SYNCED_COLLECTIONS, documents)),
+            "deleted": {collection: [] for collection in SYNCED_COLLECTIONS},
+        }
+
+    # While writes are pending, a later version may be logged before an
+    # earlier one, only the versions logged without gaps are sent
+    stalled = datetime.datetime.now() - datetime.timedelta(
+        seconds=CHANGES_CONFIG.get("stalled_write_seconds", 60)
+    )
+    if meta.get("pending_writes", 0) > 0 and (
+        meta["last_write_date"] > stalled
+    ):
+        version = meta.get("settled_version", 0)
+    entries = (
+        await get_session_collection(session_id, "changes")
+        .find({"version": {"$gt": since, "$lte": version}})
+        .to_list(None)
+    )
+    version = max(since, version)
+
+    written = {collection: [] for collection in SYNCED_COLLECTIONS}
+    deleted = {collection: [] for collection in SYNCED_COLLECTIONS}
+    for entry in entries:
+        changed = deleted if entry["deleted"] else written
+        changed[entry["collection"]].append(entry["document_id"])
+
+    # Documents are read after their entries, they are at least as recent
+    updated = {}
+    for collection, document_ids in written.items():
+        updated[collection] = (
+            await load_documents(
+                session_id, collection, {"_id": {"$in": document_ids}}
+            )
+            if document_ids
+            else []
+        )
+        found = {document["_id"] for document in updated[collection]}
+        deleted[collection] += [
+            document_id
+            for document_id in document_ids
+            if document_id not in found
+        ]
+
+    return {
+        "version": version,
+        "reset": False,
+        "updated": updated,
+        "deleted": deleted,
+    }
+
+
+@changes_router.get("/", response_class=MongoJSONResponse)
+async def route_get_changes(
+    since: int = Query(0, ge=0), session_id: str = Cookie()
+) -> MongoJSONResponse:
+    # Documents written and deleted after version since, pass the version
+    # returned as since on the next call. With reset, the local copy has to
+    # be replaced by the documents sent
+    return MongoJSONResponse(await load_changes(session_id, since))
+
+
+async def compact_session(session_id: str, cutoff: datetime.datetime) -> int:
+    changes = get_session_collection(session_id, "changes")
+    expired = {"deleted": True, "date": {"$lt": cutoff}}
+    latest = await changes.find_one(expired, sort=[("version", DESCENDING)])
+    if latest is None:
+        return 0
+
+    # Raised first, clients that may miss the deletions reload everything
+    await get_session_collection(session_id, "meta").update_one(
+        {}, {"$max": {"changes_floor": latest["version"]}}, upsert=True
+    )
+    result = await changes.delete_many(expired)
+    return result.deleted_count
+
+
+async def compact_changes(tombstone_ttl_days: float) -> int:
+    # Entries of written documents are kept, one per document, deletions
+    # are dropped once older than the TTL
+    cutoff = datetime.datetime.now() - datetime.timedelta(
+        days=tombstone_ttl_days
+    )
+    if LAYOUT == "shared":
+        session_ids = await get_shared_db()["changes"].distinct(
+            "session_id", {"deleted": True, "date": {"$lt": cutoff}}
+        )
+    else:
+        session_ids = [
+            session_id
+            for session_id in await connect_mongo().list_database_names()
+            if session_id not in SYSTEM_DATABASES
+        ]
+
+    compacted = 0
+    for session_id in session_ids:
+        compacted += await compact_session(session_id, cutoff)
+    if compacted:
+        logging.info(f"Compacted {compacted} deletions from the change logs")
+    return compacted
+
+
+async def compact_periodically():
+    while True:
+        await asyncio.sleep(
+            CHANGES_CONFIG.get("compaction_interval_seconds", 3600)
+        )
+        try:
+            await compact_changes(CHANGES_CONFIG.get("tombstone_ttl_days", 30))
+        except Exception:
+            logging.exception("Could not compact the change logs")
+
+
+def start_compactor():
+    global _compactor
+    _compactor = asyncio.create_task(compact_periodically())
+
+
+def stop_compactor():
+    global _compactor
+    if _compactor is not None:
+        _compactor.cancel()
+        _compactor = None
@@ -1,81 +1,103 @@
 import logging
 
-from json import loads
 from typing import Optional
 
-
 from bson import ObjectId
-from bson.json_util import dumps
-from fastapi import APIRouter, Cookie, HTTPException
-from pymongo.collection import Collection
+from fastapi import APIRouter, Cookie, Depends, HTTPException
+from motor.motor_asyncio import AsyncIOMotorCollection
 
-from .database import get_mongo_db
+from .database import check_etag, get_session_collection, record_changes
+from .layout import SessionCollection
 from .models import Constraint
+from .responses import MongoJSONResponse
 
 constraints_router = APIRouter(prefix="/constraints", tags=["constraints"])
 
 
-def get_constraints_collection(session_id: str) -> Collection:
-    db = get_mongo_db(session_id)
-    return db["constraints"]
+def get_constraints_collection(
+    session_id: str,
+) -> AsyncIOMotorCollection | SessionCollection:
+    return get_session_collection(session_id, "constraints")
 
 
-def insert_constraint(constraint: dict, session_id: str) -> Optional[str]:
+async def insert_constraint(
+    constraint: dict, session_id: str
+) -> Optional[str]:
     constraints_collection = get_constraints_collection(session_id)
-    result = constraints_collection.insert_one(constraint)
+    result = await constraints_collection.insert_one(constraint)
+    await record_changes(session_id, "constraints", [result.inserted_id])
     return result.inserted_id
 
 
-@constraints_router.get("/")
-def route_get_constraints(session_id: str = Cookie()) -> dict:
+async def update_constraint(constraint: dict, session_id: str):
+    constraints_collection = get_constraints_collection(session_id)
+    constraint_id = ObjectId(constraint["_id"])
+    await constraints_collection.find_one_and_update(
+        {"_id": constraint_id},
+        {"$set": constraint},
+    )
+    await record_changes(session_id, "constraints", [constraint_id])
+
+
+async def delete_constraint(constraint_id: str, session_id: str):
+    constraints_collection = get_constraints_collection(session_id)
+    constraint_id = ObjectId(constraint_id)
+    await constraints_collection.delete_one({"_id": constraint_id})
+    await record_changes(
+        session_id, "constraints", [constraint_id], deleted=True
+    )
+
+
+@constraints_router.get("/", response_class=MongoJSONResponse)
+async def route_get_constraints(
+    session_id: str = Cookie(),
+    headers: dict[str, str] = Depends(check_etag),
+) -> MongoJSONResponse:
     constraints_collection = get_constraints_collection(session_id)
-    constraints = constraints_collection.find()
-    return loads(dumps(constraints))
+    constraints = await constraints_collection.find().to_list(None)
+    return MongoJSONResponse(constraints, headers=headers)
 
 
 @constraints_router.put("/")
-def route_insert_constraint(
+async def route_insert_constraint(
     constraint: Constraint, session_id: str = Cookie()
 ) -> dict:
     constraint = constraint.dict()
-    constraint_id = insert_constraint(constraint, session_id)
+    constraint_id = await insert_constraint(constraint, session_id)
     logging.info(f"Created constraint {constraint_id}")
     return {"inserted_id": str(constraint_id)}
 
 
-@constraints_router.get("/{constraint_id}")
-def route_get_constraint(
-    constraint_id: str, session_id: str = Cookie()
-) -> dict:
+@constraints_router.get("/{constraint_id}", response_class=MongoJSONResponse)
+async def route_get_constraint(
+    constraint_id: str,
+    session_id: str = Cookie(),
+    headers: dict[str, str] = Depends(check_etag),
+) -> MongoJSONResponse:
     constraints_collection = get_constraints_collection(session_id)
-    constraint = constraints_collection.find_one(
+    constraint = await constraints_collection.find_one(
         {"_id": ObjectId(constraint_id)}
     )
     if not constraint:
         raise HTTPException(status_code=404, detail="Constraint not found")
-    return loads(dumps(constraint))
+    return MongoJSONResponse(constraint, headers=headers)
 
 
 @constraints_router.post("/")
-def route_update_constraint(
+async def route_update_constraint(
     constraint: Constraint, session_id: str = Cookie()
 ) -> dict:
     constraint = constraint.dict()
-    constraints_collection = get_constraints_collection(session_id)
     constraint_id = constraint["_id"]
-    constraints_collection.find_one_and_update(
-        {"_id": ObjectId(constraint_id)},
-        {"$set": constraint},
-    )
+    await update_constraint(constraint, session_id)
     logging.info(f"Updated constraint {constraint_id}")
     return {"updated_id": str(constraint_id)}
 
 
 @constraints_router.delete("/{constraint_id}")
-def route_delete_constraint(
+async def route_delete_constraint(
     constraint_id: str, session_id: str = Cookie()
 ) -> dict:
-    constraints_collection = get_constraints_collection(session_id)
-    constraints_collection.delete_one({"_id": ObjectId(constraint_id)})
+    await delete_constraint(constraint_id, session_id)
     logging.info(f"Deleted constraint {constraint_id}")
     return {"deleted_id": str(constraint_id)}
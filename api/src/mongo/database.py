@@ -1,16 +1,40 @@
+import asyncio
 import datetime
+import logging
+import threading
 
+import orjson
 import yaml
-from bson import json_util
-import json
 
-from fastapi import APIRouter, Cookie
-from pymongo import MongoClient
-from pymongo.database import Database
+from typing import AsyncIterator, Literal
 
-from pydantic import BaseModel
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import (
+    APIRouter,
+    Cookie,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+)
+from fastapi.responses import StreamingResponse
+from motor.motor_asyncio import (
+    AsyncIOMotorClient,
+    AsyncIOMotorCollection,
+    AsyncIOMotorDatabase,
+)
+from optimization.cache import invalidate_session
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError, OperationFailure, PyMongoError
+from pymongo.results import BulkWriteResult
 
+from pydantic import BaseModel, ValidationError
+
+from .layout import SessionCollection, make_update_one
 from .models import AllocationStatement, Asset, Constraint
+from .responses import buffer_chunks, dump_bson, gzip_chunks
 
 with open("/conf/project_config.yml", "r") as f:
     PROJECT_CONFIG = yaml.safe_load(f)
@@ -18,64 +42,696 @@ with open("/conf/project_config.yml", "r") as f:
 mongo_router = APIRouter(prefix="/mongo", tags=["mongo"])
 
 
-def get_mongo_db(session_id) -> Database:
-    host = PROJECT_CONFIG.get("mongodb", {}).get("host")
-    port = PROJECT_CONFIG.get("mongodb", {}).get("port")
-    user = PROJECT_CONFIG.get("mongodb", {}).get("user")
-    password = PROJECT_CONFIG.get("mongodb", {}).get("password")
-    # db = PROJECT_CONFIG.get("mongodb", {}).get("db")
+# Process-wide client, its connection pool is shared by every session
+_client: AsyncIOMotorClient | None = None
+
+
+def connect_mongo() -> AsyncIOMotorClient:
+    global _client
+    if _client is None:
+        config = PROJECT_CONFIG.get("mongodb", {})
+        _client = AsyncIOMotorClient(
+            host=f"mongodb://{config.get('host')}/{config.get('db')}",
+            port=config.get("port"),
+            username=config.get("user"),
+            password=config.get("password"),
+            maxPoolSize=config.get("max_pool_size", 100),
+            minPoolSize=config.get("min_pool_size", 0),
+            serverSelectionTimeoutMS=config.get(
+                "server_selection_timeout_ms", 30000
+            ),
+            connectTimeoutMS=config.get("connect_timeout_ms", 20000),
+            socketTimeoutMS=config.get("socket_timeout_ms"),
+            waitQueueTimeoutMS=config.get("wait_queue_timeout_ms"),
+        )
+    return _client
+
+
+def close_mongo():
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+# Either one database per session, or collections shared by every session
+# where each document carries its session_id
+LAYOUT = PROJECT_CONFIG.get("mongodb", {}).get("layout", "per_session")
+
+
+def get_shared_db() -> AsyncIOMotorDatabase:
+    return connect_mongo()[PROJECT_CONFIG.get("mongodb", {}).get("db")]
+
+
+def get_mongo_db(session_id) -> AsyncIOMotorDatabase:
+    # Cheap handle on the shared client, created lazily outside the app
+    if LAYOUT == "shared":
+        return get_shared_db()
+    return connect_mongo()[session_id]
+
+
+def get_session_collection(
+    session_id: str, name: str
+) -> AsyncIOMotorCollection | SessionCollection:
+    collection = get_mongo_db(session_id)[name]
+    if LAYOUT == "shared":
+        return SessionCollection(collection, session_id)
+    return collection
+
+
+async def write_in_batch(
+    collection: AsyncIOMotorCollection | SessionCollection, operations: list
+) -> BulkWriteResult:
+    # A single round trip for the whole batch, inside a transaction when
+    # the deployment supports them
+    if not PROJECT_CONFIG.get("mongodb", {}).get("transactions"):
+        return await collection.bulk_write(operations, ordered=False)
+
+    async with await connect_mongo().start_session() as session:
+        async with session.start_transaction():
+            return await collection.bulk_write(operations, session=session)
+
+
+# Databases whose indexes were already ensured by this process
+_indexed_databases: set[str] = set()
+_index_backfill: asyncio.Task | None = None
+
+
+async def create_indexes(
+    db: AsyncIOMotorDatabase, suffix: str = "", layout: str | None = None
+):
+    config = PROJECT_CONFIG.get("mongodb", {})
+    layout = layout or LAYOUT
+    # Shared collections lead every index with session_id
+    scope = [("session_id", ASCENDING)] if layout == "shared" else []
+    indexes = [
+        db[config.get("assets") + suffix].create_index(
+            scope + [("name", ASCENDING), ("class_name", ASCENDING)],
+            unique=True,
+        ),
+        db[config.get("allocation") + suffix].create_index(
+            scope + [("object_name", ASCENDING)], unique=True
+        ),
+    ]
+    if layout == "shared":
+        indexes.append(db["constraints" + suffix].create_index(scope))
+        if not suffix:
+            indexes.append(db["meta"].create_index(scope, unique=True))
+    if not suffix:
+        indexes += [
+            db["changes"].create_index(
+                scope
+                + [("collection", ASCENDING), ("document_id", ASCENDING)],
+                unique=True,
+            ),
+            db["changes"].create_index(scope + [("version", ASCENDING)]),
+        ]
+    await asyncio.gather(*indexes)
+
+
+async def ensure_database_indexes(db: AsyncIOMotorDatabase):
+    if db.name in _indexed_databases:
+        return
+
+    try:
+        await create_indexes(db)
+    except OperationFailure as exception:
+        logging.warning(
+            f"Could not create indexes for database {db.name}: {exception}"
+        )
+    _indexed_databases.add(db.name)
+
+
+async def ensure_indexes(session_id: str):
+    await ensure_database_indexes(get_mongo_db(session_id))
+
+
+async def ensure_all_indexes():
+    if LAYOUT == "shared":
+        await ensure_database_indexes(get_shared_db())
+        return
+
+    try:
+        session_ids = await connect_mongo().list_database_names()
+    except OperationFailure as exception:
+        logging.warning(f"Could not list sessions: {exception}")
+        return
+    for session_id in session_ids:
+        if session_id not in ["admin", "config", "local"]:
+            await ensure_indexes(session_id)
 
-    client = MongoClient(
-        host=f"mongodb://{host}/{session_id}",
-        port=port,
-        username=user,
-        password=password,
+
+async def backfill_indexes():
+    # Sessions written to before the backfill reaches them have their
+    # indexes ensured on the way, Mongo may also not be up yet
+    try:
+        await ensure_all_indexes()
+    except PyMongoError:
+        logging.exception("Could not backfill the indexes")
+
+
+def start_index_backfill():
+    global _index_backfill
+    _index_backfill = asyncio.create_task(backfill_indexes())
+
+
+def stop_index_backfill():
+    global _index_backfill
+    if _index_backfill is not None:
+        _index_backfill.cancel()
+        _index_backfill = None
+
+
+# Date of the last write of each session since the last flush to meta
+_activity: dict[str, datetime.datetime] = {}
+# Date of the last request of each session, reads included
+_access: dict[str, datetime.datetime] = {}
+_activity_lock = threading.Lock()
+_activity_flusher: asyncio.Task | None = None
+
+
+async def record_write(session_id: str, logged: bool = False) -> int:
+    # Bumps the version of the session, which read routes send as ETag.
+    # Logged writes are counted as pending until their changes are logged
+    invalidate_session(session_id)
+    date = datetime.datetime.now()
+    with _activity_lock:
+        _activity[session_id] = date
+    update = {"$inc": {"version": 1}}
+    if logged:
+        update = {
+            "$inc": {"version": 1, "pending_writes": 1},
+            "$max": {"last_write_date": date},
+        }
+    meta = await get_session_collection(
+        session_id, "meta"
+    ).find_one_and_update(
+        {},
+        update,
+        {"version": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return meta["version"]
+
+
+async def settle_write(session_id: str):
+    # Once no write is pending, the changes of every version up to the
+    # current one are logged
+    meta_collection = get_session_collection(session_id, "meta")
+    meta = await meta_collection.find_one_and_update(
+        {},
+        {"$inc": {"pending_writes": -1}},
+        {"version": 1, "pending_writes": 1},
+        return_document=ReturnDocument.AFTER,
     )
+    if meta is not None and meta.get("pending_writes") == 0:
+        await meta_collection.update_one(
+            {"pending_writes": 0, "version": meta["version"]},
+            {"$max": {"settled_version": meta["version"]}},
+        )
+
+
+async def record_changes(
+    session_id: str, collection: str, document_ids: list, deleted: bool = False
+) -> int:
+    # Logs the documents written under the new version, for the clients
+    # syncing from /changes. Each document keeps a single entry, the log
+    # does not grow with the number of writes
+    version = await record_write(session_id, logged=True)
+    try:
+        if document_ids:
+            await log_changes(
+                session_id, collection, document_ids, deleted, version
+            )
+    finally:
+        await settle_write(session_id)
+    return version
+
+
+async def log_changes(
+    session_id: str,
+    collection: str,
+    document_ids: list,
+    deleted: bool,
+    version: int,
+):
+    # Concurrent writes may log out of order, an entry is only replaced
+    # by a later version. Otherwise the upsert hits the unique index
+    date = datetime.datetime.now()
+    changes = get_session_collection(session_id, "changes")
+    try:
+        await changes.bulk_write(
+            [
+                make_update_one(
+                    changes,
+                    {
+                        "collection": collection,
+                        "document_id": document_id,
+                        "version": {"$lt": version},
+                    },
+                    {
+                        "$set": {
+                            "version": version,
+                            "deleted": deleted,
+                            "date": date,
+                        }
+                    },
+                    upsert=True,
+                )
+                for document_id in document_ids
+            ],
+            ordered=False,
+        )
+    except BulkWriteError as exception:
+        if any(
+            error["code"] != 11000
+            for error in exception.details["writeErrors"]
+        ):
+            raise
+
+
+async def reset_changes(session_id: str, version: int):
+    # Clients synced before this version have to reload every document
+    await get_session_collection(session_id, "changes").delete_many({})
+    await get_session_collection(session_id, "meta").update_one(
+        {}, {"$max": {"changes_floor": version}}, upsert=True
+    )
+
+
+async def get_etag(session_id: str) -> str | None:
+    meta = await get_session_collection(session_id, "meta").find_one(
+        {}, {"version": 1}
+    )
+    if meta is None:
+        return None
+    # The id of meta tells apart a session reaped and written to again
+    return f'"{meta["_id"]}-{meta.get("version", 0)}"'
+
+
+async def check_etag(
+    session_id: str = Cookie(), if_none_match: str | None = Header(None)
+) -> dict[str, str]:
+    # Dependency of the read routes, answers 304 when the client copy is
+    # current and returns the headers to send along with the response
+    etag = await get_etag(session_id)
+    if etag is None:
+        return {}
+    if if_none_match:
+        tags = {
+            tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+        }
+        if etag in tags or "*" in tags:
+            raise HTTPException(status_code=304, headers={"ETag": etag})
+    return {"ETag": etag}
+
+
+def record_access(session_id: str):
+    # Kept in memory, meta is only written once per flush interval
+    with _activity_lock:
+        _access[session_id] = datetime.datetime.now()
 
-    db = client[session_id]
+
+def has_pending_activity(session_id: str) -> bool:
+    with _activity_lock:
+        return session_id in _activity or session_id in _access
+
+
+async def flush_activity():
+    with _activity_lock:
+        pending = _activity.copy()
+        _activity.clear()
+        accessed = _access.copy()
+        _access.clear()
 
     # Keep track of the last modification date for the session
-    meta_collection = db["meta"]
-    if meta_collection.count_documents({}) == 0:
-        meta_collection.insert_one(
-            {"last_modif_date": datetime.datetime.now()}
+    for session_id, last_modif_date in pending.items():
+        await get_session_collection(session_id, "meta").update_one(
+            {},
+            {"$max": {"last_modif_date": last_modif_date}},
+            upsert=True,
         )
-    else:
-        meta_collection.update_one(
-            {}, {"$set": {"last_modif_date": datetime.datetime.now()}}
+    # Sessions never written to have no meta, none is created for them
+    for session_id, last_access_date in accessed.items():
+        await get_session_collection(session_id, "meta").update_one(
+            {}, {"$max": {"last_access_date": last_access_date}}
+        )
+    if pending or accessed:
+        logging.info(
+            f"Flushed activity of {len(pending.keys() | accessed.keys())} "
+            "sessions"
+        )
+
+
+async def flush_activity_periodically(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush_activity()
+        except Exception:
+            logging.exception("Could not flush session activity")
+
+
+def start_activity_flusher():
+    global _activity_flusher
+    interval = PROJECT_CONFIG.get("mongodb", {}).get(
+        "activity_flush_interval_seconds", 60
+    )
+    _activity_flusher = asyncio.create_task(
+        flush_activity_periodically(interval)
+    )
+
+
+async def stop_activity_flusher():
+    global _activity_flusher
+    if _activity_flusher is not None:
+        _activity_flusher.cancel()
+        _activity_flusher = None
+    await flush_activity()
+
+
+IMPORT_STAGING_SUFFIX = "_import"
+EXPORT_BATCH_SIZE = PROJECT_CONFIG.get("mongodb", {}).get(
+    "export_batch_size", 1000
+)
+
+
+async def list_exported_collections(session_id: str) -> list[str]:
+    if LAYOUT == "shared":
+        return sorted(IMPORTED_COLLECTIONS)
+
+    return sorted(
+        collection
+        for collection in await get_mongo_db(
+            session_id
+        ).list_collection_names()
+        if collection not in ["meta", "changes"]
+        and not collection.endswith(IMPORT_STAGING_SUFFIX)
+    )
+
+
+async def stream_export(
+    session_id: str,
+    collections: list[str],
+    export_format: str,
+) -> AsyncIterator[bytes]:
+    # Documents are written as the cursors return them, so that only one
+    # batch per collection is ever held in memory
+    ndjson = export_format == "ndjson"
+    if not ndjson:
+        yield b"{"
+    for position, collection in enumerate(collections):
+        if not ndjson:
+            yield (b"," if position else b"") + dump_bson(collection) + b":["
+        cursor = get_session_collection(session_id, collection).find(
+            {}, {"_id": 0}, batch_size=EXPORT_BATCH_SIZE
         )
+        first = True
+        async for document in cursor:
+            if ndjson:
+                yield dump_bson(
+                    {"collection": collection, "document": document}
+                ) + b"\n"
+            else:
+                yield (b"" if first else b",") + dump_bson(document)
+            first = False
+        if not ndjson:
+            yield b"]"
+    if not ndjson:
+        yield b"}"
 
-    return db
+
+def make_export_response(
+    chunks: AsyncIterator[bytes],
+    export_format: str,
+    compress: bool,
+    headers: dict | None = None,
+) -> StreamingResponse:
+    headers = dict(headers or {})
+    chunks = buffer_chunks(chunks)
+    if compress:
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    media_type = (
+        "application/x-ndjson"
+        if export_format == "ndjson"
+        else "application/json"
+    )
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
 
 
 @mongo_router.get("/export")
-def export_data(session_id: str = Cookie()) -> dict:
-    mongo_db = get_mongo_db(session_id)
-    collections = mongo_db.list_collection_names()
-    export_data = {}
-    for collection in collections:
-        if collection not in ["meta"]:
-            export_data[collection] = list(
-                mongo_db[collection].find({}, {"_id": 0})
+async def export_data(
+    export_format: Literal["json", "ndjson"] = Query("json", alias="format"),
+    compress: bool = False,
+    session_id: str = Cookie(),
+    headers: dict[str, str] = Depends(check_etag),
+) -> StreamingResponse:
+    collections = await list_exported_collections(session_id)
+    return make_export_response(
+        stream_export(session_id, collections, export_format),
+        export_format,
+        compress,
+        headers,
+    )
+
+
+@mongo_router.get("/export/{collection}")
+async def export_collection_chunk(
+    collection: str,
+    after: str | None = None,
+    limit: int = Query(EXPORT_BATCH_SIZE, gt=0),
+    compress: bool = False,
+    session_id: str = Cookie(),
+) -> StreamingResponse:
+    # One page of a collection as NDJSON, ordered by _id, in the records of
+    # the full NDJSON export: concatenated pages can be imported back. The
+    # X-Next-Cursor header holds the value to pass as after to fetch the
+    # next page, it is missing on the last one
+    if collection not in await list_exported_collections(session_id):
+        raise HTTPException(status_code=404, detail="Collection not found")
+
+    query = {}
+    if after is not None:
+        try:
+            query = {"_id": {"$gt": ObjectId(after)}}
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    documents = (
+        await get_session_collection(session_id, collection)
+        .find(query)
+        .sort("_id", ASCENDING)
+        .limit(limit)
+        .to_list(None)
+    )
+    headers = {}
+    if len(documents) == limit:
+        headers["X-Next-Cursor"] = str(documents[-1]["_id"])
+
+    async def stream_chunk() -> AsyncIterator[bytes]:
+        for document in documents:
+            document.pop("_id")
+            yield dump_bson(
+                {"collection": collection, "document": document}
+            ) + b"\n"
+
+    return make_export_response(stream_chunk(), "ndjson", compress, headers)
+
+
+IMPORT_BATCH_SIZE = PROJECT_CONFIG.get("mongodb", {}).get(
+    "import_batch_size", 1000
+)
+
+# Model validating the documents of each imported collection
+IMPORTED_COLLECTIONS: dict[str, type[BaseModel]] = {
+    "assets": Asset,
+    "allocation": AllocationStatement,
+    "constraints": Constraint,
+}
+
+# Documents inserted so far by the running import of each session
+_import_progress: dict[str, dict[str, int]] = {}
+
+
+async def read_import(request: Request) -> AsyncIterator[tuple[str, dict]]:
+    # NDJSON uploads, as written by the export, are parsed line by line as
+    # they arrive. Plain JSON documents can only be parsed once complete
+    if request.headers.get("content-type", "").startswith(
+        "application/x-ndjson"
+    ):
+        buffer = b""
+        async for chunk in request.stream():
+            *lines, buffer = (buffer + chunk).split(b"\n")
+            for line in lines:
+                if line.strip():
+                    record = orjson.loads(line)
+                    yield record.get("collection"), record.get("document")
+        if buffer.strip():
+            record = orjson.loads(buffer)
+            yield record.get("collection"), record.get("document")
+        return
+
+    data = orjson.loads(await request.body())
+    for collection, documents in data.items():
+        for document in documents:
+            yield collection, document
+
+
+async def import_documents(
+    staging: dict[str, AsyncIOMotorCollection | SessionCollection],
+    records: AsyncIterator[tuple[str, dict]],
+    counts: dict[str, int],
+):
+    batches = {collection: [] for collection in IMPORTED_COLLECTIONS}
+
+    async def insert_batch(collection: str):
+        await staging[collection].insert_many(batches[collection])
+        counts[collection] += len(batches[collection])
+        batches[collection] = []
+
+    position = 0
+    async for collection, document in records:
+        position += 1
+        if collection not in IMPORTED_COLLECTIONS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown collection {collection} at record {position}",
+            )
+        try:
+            document = IMPORTED_COLLECTIONS[collection].parse_obj(document)
+        except ValidationError as exception:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid record {position}: {exception}",
             )
+        batches[collection].append(document.dict())
+        if len(batches[collection]) >= IMPORT_BATCH_SIZE:
+            await insert_batch(collection)
 
-    return json.loads(json_util.dumps(export_data))
+    for collection in IMPORTED_COLLECTIONS:
+        if batches[collection]:
+            await insert_batch(collection)
 
 
-class DataBase(BaseModel):
-    assets: list[Asset]
-    allocation: list[AllocationStatement]
-    constraints: list[Constraint]
+async def copy_staging(
+    session_id: str,
+    collection: str,
+    staging_collection: SessionCollection,
+    session=None,
+):
+    # Shared collections cannot be renamed, the documents of the session
+    # are replaced then copied over from the staging collection in batches
+    target = get_session_collection(session_id, collection)
+    await target.delete_many({}, session=session)
+    batch = []
+    async for document in staging_collection.find(
+        {}, {"_id": 0}, batch_size=IMPORT_BATCH_SIZE, session=session
+    ):
+        batch.append(document)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await target.insert_many(batch, session=session)
+            batch = []
+    if batch:
+        await target.insert_many(batch, session=session)
+
+
+async def swap_collections(
+    session_id: str,
+    staging: dict[str, AsyncIOMotorCollection | SessionCollection],
+    counts: dict[str, int],
+):
+    if LAYOUT != "shared":
+        # Each rename atomically replaces its collection
+        for collection, staging_collection in staging.items():
+            if counts[collection]:
+                await staging_collection.rename(collection, dropTarget=True)
+            else:
+                await get_mongo_db(session_id).drop_collection(collection)
+                await staging_collection.drop()
+        return
+
+    if PROJECT_CONFIG.get("mongodb", {}).get("transactions"):
+        # Readers see either the previous documents or the imported ones,
+        # and a failed copy leaves the previous ones in place
+        async with await connect_mongo().start_session() as session:
+            async with session.start_transaction():
+                for collection, staging_collection in staging.items():
+                    await copy_staging(
+                        session_id, collection, staging_collection, session
+                    )
+    else:
+        # Without transactions, readers may see a partial import until the
+        # copy is done
+        for collection, staging_collection in staging.items():
+            await copy_staging(session_id, collection, staging_collection)
+    await asyncio.gather(
+        *[collection.drop() for collection in staging.values()]
+    )
+
+
+async def stage_import(
+    request: Request,
+    mongo_db: AsyncIOMotorDatabase,
+    staging: dict[str, AsyncIOMotorCollection | SessionCollection],
+    counts: dict[str, int],
+):
+    try:
+        await asyncio.gather(
+            *[collection.drop() for collection in staging.values()]
+        )
+        # Built before the inserts, the renames carry them over
+        await create_indexes(mongo_db, IMPORT_STAGING_SUFFIX)
+        await import_documents(staging, read_import(request), counts)
+    except Exception as exception:
+        await asyncio.gather(
+            *[collection.drop() for collection in staging.values()]
+        )
+        if isinstance(exception, BulkWriteError):
+            raise HTTPException(
+                status_code=400, detail="The import contains duplicates"
+            )
+        if isinstance(exception, orjson.JSONDecodeError):
+            raise HTTPException(status_code=400, detail="Invalid JSON")
+        raise
 
 
 @mongo_router.post("/import")
-def import_data(import_data: DataBase, session_id: str = Cookie()) -> dict:
-    import_data = import_data.dict()
+async def import_data(request: Request, session_id: str = Cookie()) -> dict:
+    # Documents go to staging collections in bounded batches, the session
+    # collections are only replaced once the whole upload is valid
+    if session_id in _import_progress:
+        raise HTTPException(
+            status_code=409, detail="An import is already running"
+        )
+    counts = _import_progress[session_id] = {
+        collection: 0 for collection in IMPORTED_COLLECTIONS
+    }
 
     mongo_db = get_mongo_db(session_id)
+    staging = {
+        collection: get_session_collection(
+            session_id, collection + IMPORT_STAGING_SUFFIX
+        )
+        for collection in IMPORTED_COLLECTIONS
+    }
+    # Held until the staging collections are swapped in, another import
+    # would drop them mid-swap
+    try:
+        await stage_import(request, mongo_db, staging, counts)
+        await swap_collections(session_id, staging, counts)
+    finally:
+        _import_progress.pop(session_id, None)
+
+    await reset_changes(session_id, await record_write(session_id))
+    _indexed_databases.discard(mongo_db.name)
+    await ensure_indexes(session_id)
+    logging.info(f"Imported {counts} into session {session_id}")
+
+    return {"status": "ok", "counts": counts}
 
-    for collection in import_data.keys():
-        mongo_db.drop_collection(collection)
-        mongo_db[collection].insert_many(import_data[collection])
 
-    return {"status": "ok"}
+@mongo_router.get("/import/progress")
+async def import_progress(session_id: str = Cookie()) -> dict:
+    counts = _import_progress.get(session_id)
+    return {"running": counts is not None, "counts": counts or {}}
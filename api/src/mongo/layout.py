@@ -0,0 +1,137 @@
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorCursor
+from pymongo import UpdateOne
+from pymongo.results import BulkWriteResult
+
+
+class SessionCollection:
+    # A collection shared by every session, seen through one of them: the
+    # filters, the inserted documents and the upserts are scoped by
+    # session_id, which is hidden from the documents read back
+    def __init__(self, collection: AsyncIOMotorCollection, session_id: str):
+        self.collection = collection
+        self.session_id = session_id
+
+    @property
+    def name(self) -> str:
+        return self.collection.name
+
+    def scope(self, filter: dict | None = None) -> dict:
+        return {**(filter or {}), "session_id": self.session_id}
+
+    def hide_session(self, projection: dict | None = None) -> dict:
+        if projection is None:
+            return {"session_id": 0}
+        if any(value for key, value in projection.items() if key != "_id"):
+            # Inclusion projections leave session_id out already
+            return projection
+        return {**projection, "session_id": 0}
+
+    def tag(self, document: dict) -> dict:
+        # Tagged in place, like the driver adds _id to inserted documents
+        document["session_id"] = self.session_id
+        return document
+
+    def find(
+        self,
+        filter: dict | None = None,
+        projection: dict | None = None,
+        **kwargs,
+    ) -> AsyncIOMotorCursor:
+        return self.collection.find(
+            self.scope(filter), self.hide_session(projection), **kwargs
+        )
+
+    async def find_one(
+        self,
+        filter: dict | None = None,
+        projection: dict | None = None,
+        **kwargs,
+    ) -> dict | None:
+        return await self.collection.find_one(
+            self.scope(filter), self.hide_session(projection), **kwargs
+        )
+
+    async def find_one_and_update(
+        self,
+        filter: dict,
+        update: dict,
+        projection: dict | None = None,
+        **kwargs,
+    ) -> dict | None:
+        return await self.collection.find_one_and_update(
+            self.scope(filter),
+            update,
+            self.hide_session(projection),
+            **kwargs,
+        )
+
+    async def find_one_and_delete(
+        self, filter: dict, projection: dict | None = None, **kwargs
+    ) -> dict | None:
+        return await self.collection.find_one_and_delete(
+            self.scope(filter), self.hide_session(projection), **kwargs
+        )
+
+    async def count_documents(self, filter: dict, **kwargs) -> int:
+        return await self.collection.count_documents(
+            self.scope(filter), **kwargs
+        )
+
+    def aggregate(self, pipeline: list[dict], **kwargs):
+        return self.collection.aggregate(
+            [{"$match": self.scope()}, {"$project": {"session_id": 0}}]
+            + pipeline,
+            **kwargs,
+        )
+
+    async def insert_one(self, document: dict, **kwargs):
+        return await self.collection.insert_one(self.tag(document), **kwargs)
+
+    async def insert_many(self, documents: list[dict], **kwargs):
+        return await self.collection.insert_many(
+            [self.tag(document) for document in documents], **kwargs
+        )
+
+    async def update_one(self, filter: dict, update: dict, **kwargs):
+        # Upserts take session_id from the filter
+        return await self.collection.update_one(
+            self.scope(filter), update, **kwargs
+        )
+
+    async def update_many(self, filter: dict, update: dict, **kwargs):
+        return await self.collection.update_many(
+            self.scope(filter), update, **kwargs
+        )
+
+    async def delete_one(self, filter: dict, **kwargs):
+        return await self.collection.delete_one(self.scope(filter), **kwargs)
+
+    async def delete_many(self, filter: dict, **kwargs):
+        return await self.collection.delete_many(self.scope(filter), **kwargs)
+
+    async def drop(self):
+        await self.delete_many({})
+
+    def scoped_update_one(
+        self, filter: dict, update: dict, upsert: bool = False, **kwargs
+    ) -> UpdateOne:
+        # Upserts take session_id from the filter
+        return UpdateOne(self.scope(filter), update, upsert=upsert, **kwargs)
+
+    async def bulk_write(self, requests: list, **kwargs) -> BulkWriteResult:
+        # Requests are sent as they are, build them with the scoped helpers
+        return await self.collection.bulk_write(requests, **kwargs)
+
+
+def make_update_one(
+    collection: AsyncIOMotorCollection | SessionCollection,
+    filter: dict,
+    update: dict,
+    upsert: bool = False,
+    **kwargs,
+) -> UpdateOne:
+    # Bulk write request for either layout, scoped to the session when the
+    # collection is shared
+    if isinstance(collection, SessionCollection):
+        return collection.scoped_update_one(filter, update, upsert, **kwargs)
+    return UpdateOne(filter, update, upsert=upsert, **kwargs)
@@ -0,0 +1,132 @@
+import argparse
+import asyncio
+import logging
+
+from pymongo import ReplaceOne
+
+from .database import (
+    PROJECT_CONFIG,
+    connect_mongo,
+    create_indexes,
+    get_shared_db,
+)
+
+
+# Moves the data from one database per session to the collections shared by
+# every session, run it from the API container with
+#   python -m mongo.migrate [--dry-run] [--drop-source]
+# then set mongodb.layout to shared
+
+SYSTEM_DATABASES = ["admin", "config", "local"]
+
+
+def get_migrated_collections() -> list[str]:
+    config = PROJECT_CONFIG.get("mongodb", {})
+    return [
+        config.get("assets"),
+        config.get("allocation"),
+        "constraints",
+        "meta",
+        "changes",
+    ]
+
+
+async def copy_session(
+    source, target, session_id: str, batch_size: int, dry_run: bool
+) -> dict[str, int]:
+    counts = {}
+    for collection in get_migrated_collections():
+        if dry_run:
+            counts[collection] = await source[collection].count_documents({})
+            continue
+
+        # Replacing by _id makes the migration safe to run again
+        count, batch = 0, []
+        async for document in source[collection].find(batch_size=batch_size):
+            batch.append(
+                ReplaceOne(
+                    {"_id": document["_id"]},
+                    {**document, "session_id": session_id},
+                    upsert=True,
+                )
+            )
+            if len(batch) >= batch_size:
+                await target[collection].bulk_write(batch, ordered=False)
+                count, batch = count + len(batch), []
+        if batch:
+            await target[collection].bulk_write(batch, ordered=False)
+            count += len(batch)
+        counts[collection] = count
+    return counts
+
+
+async def tag_in_place(
+    target, session_id: str, dry_run: bool
+) -> dict[str, int]:
+    # The shared database used to be the database of the session of the
+    # same name, its documents only lack their session_id
+    counts = {}
+    for collection in get_migrated_collections():
+        untagged = {"session_id": {"$exists": False}}
+        if dry_run:
+            counts[collection] = await target[collection].count_documents(
+                untagged
+            )
+            continue
+        # Its indexes are not scoped by session yet
+        for name, index in (
+            await target[collection].index_information()
+        ).items():
+            if name != "_id_" and index["key"][0][0] != "session_id":
+                await target[collection].drop_index(name)
+        result = await target[collection].update_many(
+            untagged, {"$set": {"session_id": session_id}}
+        )
+        counts[collection] = result.modified_count
+    return counts
+
+
+async def migrate(batch_size: int, dry_run: bool, drop_source: bool):
+    client = connect_mongo()
+    target = get_shared_db()
+    shared_db = target.name
+
+    counts = await tag_in_place(target, shared_db, dry_run)
+    logging.info(f"Session {shared_db}: {counts}")
+    if not dry_run:
+        await create_indexes(target, layout="shared")
+
+    for session_id in await client.list_database_names():
+        if session_id in SYSTEM_DATABASES + [shared_db]:
+            continue
+        counts = await copy_session(
+            client[session_id], target, session_id, batch_size, dry_run
+        )
+        logging.info(f"Session {session_id}: {counts}")
+        if drop_source and not dry_run:
+            await client.drop_database(session_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Migrate sessions to the shared collections layout"
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only count the documents that would be migrated",
+    )
+    parser.add_argument(
+        "--drop-source",
+        action="store_true",
+        help="Drop the database of each session once copied",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(migrate(args.batch_size, args.dry_run, args.drop_source))
+
+
+if __name__ == "__main__":
+    main()
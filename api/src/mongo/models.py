@@ -26,6 +26,15 @@ class Asset(BaseModel):
         return v
 
 
+class AssetValue(BaseModel):
+    name: str
+    value: float
+
+
+class AssetValues(BaseModel):
+    assets: list[AssetValue]
+
+
 # Allocation
 
 
@@ -56,3 +65,15 @@ class Constraint(BaseModel):
     assets: list[ConstraintedAsset]
     operator: Literal["leq", "geq", "eq"]
     value: float
+
+
+# Optimization
+
+
+class AssetTransfer(BaseModel):
+    asset_name: str
+    new_value: float
+
+
+class TransferPlan(BaseModel):
+    asset_transfers: list[AssetTransfer]
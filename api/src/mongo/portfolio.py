@@ -0,0 +1,39 @@
+import asyncio
+
+from fastapi import APIRouter, Cookie, Depends
+
+from .allocation import get_allocation_collection
+from .assets import get_assets_collection
+from .constraints import get_constraints_collection
+from .database import check_etag, get_session_collection
+from .responses import MongoJSONResponse
+
+portfolio_router = APIRouter(prefix="/portfolio", tags=["portfolio"])
+
+
+async def load_portfolio(session_id: str) -> dict:
+    # Read before the documents, like the ETag of the read routes
+    meta = await get_session_collection(session_id, "meta").find_one(
+        {}, {"version": 1}
+    )
+    assets, allocation, constraints = await asyncio.gather(
+        get_assets_collection(session_id).find().to_list(None),
+        get_allocation_collection(session_id).find().to_list(None),
+        get_constraints_collection(session_id).find().to_list(None),
+    )
+    return {
+        "assets": assets,
+        "allocation": {
+            statement["object_name"]: statement for statement in allocation
+        },
+        "constraints": constraints,
+        "version": (meta or {}).get("version", 0),
+    }
+
+
+@portfolio_router.get("/", response_class=MongoJSONResponse)
+async def route_get_portfolio(
+    session_id: str = Cookie(),
+    headers: dict[str, str] = Depends(check_etag),
+) -> MongoJSONResponse:
+    return MongoJSONResponse(await load_portfolio(session_id), headers=headers)
@@ -0,0 +1,128 @@
+import asyncio
+import datetime
+import logging
+
+from optimization.cache import invalidate_session
+
+from .database import (
+    LAYOUT,
+    PROJECT_CONFIG,
+    _indexed_databases,
+    connect_mongo,
+    get_shared_db,
+    has_pending_activity,
+)
+from .migrate import SYSTEM_DATABASES, get_migrated_collections
+
+
+REAPER_CONFIG = PROJECT_CONFIG.get("reaper", {})
+
+_reaper: asyncio.Task | None = None
+
+
+def get_last_use(meta: dict) -> datetime.datetime:
+    # Sessions only read from are in use too
+    return max(
+        meta["last_modif_date"],
+        meta.get("last_access_date") or meta["last_modif_date"],
+    )
+
+
+async def find_idle_sessions(
+    cutoff: datetime.datetime,
+) -> list[tuple[str, datetime.datetime]]:
+    # Sessions never flushed to meta are left alone, their age is unknown
+    client = connect_mongo()
+    if LAYOUT == "shared":
+        meta = get_shared_db()["meta"]
+        return [
+            (document["session_id"], get_last_use(document))
+            for document in await meta.find(
+                {
+                    "last_modif_date": {"$lt": cutoff},
+                    "last_access_date": {"$not": {"$gte": cutoff}},
+                }
+            ).to_list(None)
+        ]
+
+    idle_sessions = []
+    for session_id in await client.list_database_names():
+        if session_id in SYSTEM_DATABASES:
+            continue
+        meta = await client[session_id]["meta"].find_one()
+        if meta and "last_modif_date" in meta and get_last_use(meta) < cutoff:
+            idle_sessions.append((session_id, get_last_use(meta)))
+    return idle_sessions
+
+
+async def drop_session(session_id: str):
+    if LAYOUT == "shared":
+        db = get_shared_db()
+        for collection in get_migrated_collections():
+            await db[collection].delete_many({"session_id": session_id})
+    else:
+        await connect_mongo().drop_database(session_id)
+        _indexed_databases.discard(session_id)
+    invalidate_session(session_id)
+
+
+async def reap_idle_sessions(
+    ttl_days: float, batch_size: int, batch_pause: float, dry_run: bool
+) -> list[str]:
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=ttl_days)
+    idle_sessions = await find_idle_sessions(cutoff)
+
+    reaped = []
+    for start in range(0, len(idle_sessions), batch_size):
+        if start:
+            # Spread the drops to keep the load on Mongo low
+            await asyncio.sleep(batch_pause)
+        for session_id, last_use in idle_sessions[start : start + batch_size]:
+            # Used since the search, not flushed yet
+            if has_pending_activity(session_id):
+                continue
+            if dry_run:
+                logging.info(
+                    f"Would reap session {session_id}, idle since "
+                    f"{last_use}"
+                )
+            else:
+                await drop_session(session_id)
+                logging.info(
+                    f"Reaped session {session_id}, idle since " f"{last_use}"
+                )
+            reaped.append(session_id)
+
+    if reaped:
+        logging.info(
+            f"{'Would reap' if dry_run else 'Reaped'} {len(reaped)} sessions "
+            f"idle for more than {ttl_days} days"
+        )
+    return reaped
+
+
+async def reap_periodically():
+    while True:
+        await asyncio.sleep(REAPER_CONFIG.get("interval_seconds", 3600))
+        try:
+            await reap_idle_sessions(
+                REAPER_CONFIG.get("ttl_days", 90),
+                REAPER_CONFIG.get("batch_size", 10),
+                REAPER_CONFIG.get("batch_pause_seconds", 1),
+                REAPER_CONFIG.get("dry_run", True),
+            )
+        except Exception:
+            logging.exception("Could not reap idle sessions")
+
+
+def start_reaper():
+    global _reaper
+    if REAPER_CONFIG.get("enabled", True):
+        _reaper = asyncio.create_task(reap_periodically())
+
+
+def stop_reaper():
+    global _reaper
+    if _reaper is not None:
+        _reaper.cancel()
+        _reaper = None
@@ -0,0 +1,54 @@
+import zlib
+
+from typing import Any, AsyncIterator
+
+import orjson
+
+from bson import ObjectId
+from fastapi.responses import ORJSONResponse
+
+
+def encode_bson(value: Any) -> Any:
+    # Same shape as bson.json_util for the types stored by the app
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dump_bson(content: Any) -> bytes:
+    return orjson.dumps(
+        content,
+        default=encode_bson,
+        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+    )
+
+
+class MongoJSONResponse(ORJSONResponse):
+    # Serializes documents straight from the driver, in a single pass
+    def render(self, content: Any) -> bytes:
+        return dump_bson(content)
+
+
+async def buffer_chunks(
+    chunks: AsyncIterator[bytes], size: int = 64 * 1024
+) -> AsyncIterator[bytes]:
+    # Groups small chunks so that each write to the socket is worth it
+    buffer = []
+    buffered = 0
+    async for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield b"".join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,45 @@
+import hashlib
+import json
+import threading
+
+from collections import OrderedDict
+
+import yaml
+
+
+with open("/conf/project_config.yml", "r") as f:
+    PROJECT_CONFIG = yaml.safe_load(f)
+
+CACHE_SIZE = PROJECT_CONFIG.get("optimization", {}).get("cache_size", 256)
+
+# Optimization results by (session_id, data fingerprint, parameters), from
+# the least to the most recently used
+_results: OrderedDict[tuple, dict] = OrderedDict()
+_lock = threading.Lock()
+
+
+def make_fingerprint(*collections: list[dict]) -> str:
+    serialized = json.dumps(collections, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+def get_cached_result(key: tuple) -> dict | None:
+    with _lock:
+        result = _results.get(key)
+        if result is not None:
+            _results.move_to_end(key)
+        return result
+
+
+def cache_result(key: tuple, result: dict):
+    with _lock:
+        _results[key] = result
+        _results.move_to_end(key)
+        while len(_results) > CACHE_SIZE:
+            _results.popitem(last=False)
+
+
+def invalidate_session(session_id: str):
+    with _lock:
+        for key in [key for key in _results if key[0] == session_id]:
+            del _results[key]
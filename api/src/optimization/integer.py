@@ -0,0 +1,295 @@
+import heapq
+import math
+import time
+
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from scipy.optimize import Bounds, LinearConstraint, OptimizeResult
+
+from optimization.utils import (
+    Portfolio,
+    create_optimization_constraints,
+    make_positive_bounds,
+    run_optimization,
+    score_function,
+)
+
+
+# Tolerance, in lots, under which a relaxed transfer is considered integer
+INTEGRALITY_TOLERANCE = 1e-6
+
+
+@dataclass(order=True)
+class Node:
+    priority: float
+    order: int
+    bound: float = field(compare=False)
+    lower: np.ndarray = field(compare=False)
+    upper: np.ndarray = field(compare=False)
+    depth: int = field(compare=False, default=0)
+
+
+def is_feasible(
+    transfer: np.ndarray, linear_constraint: LinearConstraint
+) -> bool:
+    values = linear_constraint.A @ transfer
+    tolerance = 1e-9 * np.maximum(1, np.abs(values))
+    return bool(
+        np.all(values >= linear_constraint.lb - tolerance)
+        and np.all(values <= linear_constraint.ub + tolerance)
+    )
+
+
+def round_transfer(
+    transfer: np.ndarray,
+    lot_size: int,
+    min_lots: int,
+    total_lots: int,
+    matrix: np.ndarray,
+    lower_bounds: np.ndarray,
+    upper_bounds: np.ndarray,
+) -> np.ndarray | None:
+    # Largest remainder rounding: floor every transfer to whole lots, drop
+    # those under the minimum, then hand the missing lots one by one to the
+    # assets the furthest below their continuous transfer, as long as the
+    # user constraints (matrix rows within their bounds) still hold
+    lots = np.maximum(transfer, 0) / lot_size
+    rounded = np.floor(lots + INTEGRALITY_TOLERANCE)
+    rounded[rounded < min_lots] = 0
+    deficits = lots - rounded
+    remaining = total_lots - int(np.sum(rounded))
+    values = matrix @ (rounded * lot_size)
+    tolerance = 1e-9 * np.maximum(1, np.abs(values))
+
+    while remaining > 0:
+        # Assets without transfer need at least min_lots at once
+        added = np.where((rounded > 0) | (min_lots <= 1), 1, min_lots)
+        added[added > remaining] = 0
+        changes = matrix * (added * lot_size)
+        new_values = values[:, None] + changes
+        allowed = (added > 0) & np.all(
+            (
+                (new_values <= upper_bounds[:, None] + tolerance[:, None])
+                | (changes <= 0)
+            )
+            & (
+                (new_values >= lower_bounds[:, None] - tolerance[:, None])
+                | (changes >= 0)
+            ),
+            axis=0,
+        )
+        if not allowed.any():
+            # Let the feasibility check reject the plan rather than stall
+            allowed = added > 0
+        if not allowed.any():
+            return None
+
+        # Topping up existing transfers is preferred over opening new ones
+        preferred = allowed & (added == 1)
+        candidates = preferred if preferred.any() else allowed
+        index = np.argmax(np.where(candidates, deficits, -np.inf))
+        rounded[index] += added[index]
+        deficits[index] -= added[index]
+        remaining -= added[index]
+        values += changes[:, index]
+
+    return (rounded * lot_size).astype(int)
+
+
+def round_continuous_transfer(
+    transfer: np.ndarray,
+    portfolio: Portfolio,
+    constraints: list[dict],
+    total_amount: int,
+) -> np.ndarray:
+    # Whole currency units adding up to the amount to invest, the rounding
+    # of the integer mode with lots of one
+    linear_constraint = create_optimization_constraints(
+        constraints, portfolio, total_amount
+    )
+    rounded = round_transfer(
+        transfer,
+        1,
+        1,
+        total_amount,
+        linear_constraint.A[:-1].toarray(),
+        linear_constraint.lb[:-1],
+        linear_constraint.ub[:-1],
+    )
+    if rounded is None:
+        return np.floor(transfer).astype(int)
+    return rounded
+
+
+def find_branching(
+    transfer: np.ndarray, lot_size: int, min_lots: int, lower: np.ndarray
+) -> tuple[int, float, float] | None:
+    # Returns the asset to branch on along with the transfer values
+    # excluded between the two branches
+    lots = transfer / lot_size
+
+    # Transfers between zero and the minimum are either zero or the minimum
+    below_minimum = (lots > INTEGRALITY_TOLERANCE) & (
+        lots < min_lots - INTEGRALITY_TOLERANCE
+    )
+    below_minimum &= lower <= 0
+    if below_minimum.any():
+        index = int(np.argmax(np.where(below_minimum, lots, -np.inf)))
+        return index, 0, min_lots * lot_size
+
+    fractions = lots - np.floor(lots)
+    fractional = (fractions > INTEGRALITY_TOLERANCE) & (
+        fractions < 1 - INTEGRALITY_TOLERANCE
+    )
+    if fractional.any():
+        index = int(
+            np.argmin(np.where(fractional, np.abs(fractions - 0.5), np.inf))
+        )
+        return (
+            index,
+            math.floor(lots[index]) * lot_size,
+            math.ceil(lots[index]) * lot_size,
+        )
+
+
+def run_integer_optimization(
+    portfolio: Portfolio,
+    constraints: list[dict],
+    total_amount: int,
+    lot_size: int = 1,
+    min_transfer: float = 0,
+    time_budget: float = 1.0,
+) -> OptimizeResult:
+    if lot_size < 1:
+        raise ValueError("The lot size must be a positive integer")
+    if min_transfer < 0:
+        raise ValueError("The minimum transfer cannot be negative")
+    if time_budget <= 0:
+        raise ValueError("The time budget must be positive")
+    if total_amount % lot_size:
+        raise ValueError(
+            f"The amount to invest must be a multiple of the lot size {lot_size}"
+        )
+
+    deadline = time.monotonic() + time_budget
+    total_lots = total_amount // lot_size
+    min_lots = max(math.ceil(min_transfer / lot_size), 1)
+    linear_constraint = create_optimization_constraints(
+        constraints, portfolio, total_amount
+    )
+    # Every row but the last, which is the total amount one
+    user_rows = linear_constraint.A[:-1].toarray()
+    user_lower, user_upper = (
+        linear_constraint.lb[:-1],
+        linear_constraint.ub[:-1],
+    )
+
+    best_transfer, best_score = None, np.inf
+    n_nodes = 0
+
+    def try_incumbent(transfer):
+        nonlocal best_transfer, best_score
+        if transfer is None or not is_feasible(transfer, linear_constraint):
+            return
+        score = score_function(transfer, portfolio)
+        if score < best_score:
+            best_transfer, best_score = transfer, score
+
+    root = make_positive_bounds(portfolio)
+    queue = [Node(0, 0, -np.inf, root.lb, root.ub)]
+    while queue and time.monotonic() < deadline:
+        node = heapq.heappop(queue)
+        if node.bound >= best_score:
+            continue
+
+        n_nodes += 1
+        relaxation = run_optimization(
+            portfolio,
+            constraints,
+            total_amount,
+            # Below the root, skip the slower fallback method as the time
+            # budget is only checked between nodes
+            method=None if node.depth == 0 else "SLSQP",
+            bounds=Bounds(node.lower, node.upper),
+        )
+        if not relaxation.success or relaxation.fun >= best_score:
+            continue
+
+        had_incumbent = best_transfer is not None
+        try_incumbent(
+            round_transfer(
+                relaxation.x,
+                lot_size,
+                min_lots,
+                total_lots,
+                user_rows,
+                user_lower,
+                user_upper,
+            )
+        )
+        if best_transfer is not None and not had_incumbent:
+            # Dive depth first until a feasible plan is known, then explore
+            # the most promising nodes first to close the gap
+            for open_node in queue:
+                open_node.priority = open_node.bound
+            heapq.heapify(queue)
+
+        branching = find_branching(
+            relaxation.x, lot_size, min_lots, node.lower
+        )
+        if branching is None:
+            lots = np.round(relaxation.x / lot_size)
+            try_incumbent((lots * lot_size).astype(int))
+            continue
+
+        index, below, above = branching
+        upper = node.upper.copy()
+        upper[index] = below
+        lower = node.lower.copy()
+        lower[index] = above
+        for lower_bounds, upper_bounds in (
+            (node.lower, upper),
+            (lower, node.upper),
+        ):
+            priority = (
+                relaxation.fun
+                if best_transfer is not None
+                else -(node.depth + 1)
+            )
+            heapq.heappush(
+                queue,
+                Node(
+                    priority,
+                    n_nodes,
+                    relaxation.fun,
+                    lower_bounds,
+                    upper_bounds,
+                    node.depth + 1,
+                ),
+            )
+
+    # The remaining nodes bound the score any integer plan can reach
+    open_bounds = [node.bound for node in queue if node.bound < best_score]
+    best_bound = min(open_bounds) if open_bounds else best_score
+
+    if best_transfer is None:
+        return OptimizeResult(
+            x=None,
+            success=False,
+            message="No feasible integer plan found within the time budget",
+            nit=n_nodes,
+        )
+
+    gap = (
+        max(best_score - best_bound, 0) / best_score if best_score > 0 else 0.0
+    )
+    return OptimizeResult(
+        x=best_transfer,
+        fun=best_score,
+        success=True,
+        message="Optimal" if not open_bounds else "Time budget exhausted",
+        nit=n_nodes,
+        gap=gap,
+    )
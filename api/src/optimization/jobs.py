@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable
+
+import yaml
+
+from fastapi import HTTPException, Request
+
+from metrics import collect_records, observe_records
+from optimization.cache import cache_result
+
+
+with open("/conf/project_config.yml", "r") as f:
+    PROJECT_CONFIG = yaml.safe_load(f)
+
+OPTIMIZATION_CONFIG = PROJECT_CONFIG.get("optimization", {})
+WORKERS = OPTIMIZATION_CONFIG.get("workers") or os.cpu_count() or 1
+# Solves either running or waiting for a worker, over which new ones are
+# turned down
+MAX_PENDING_SOLVES = OPTIMIZATION_CONFIG.get("max_pending_solves", 16)
+JOB_TTL_SECONDS = OPTIMIZATION_CONFIG.get("job_ttl_seconds", 600)
+# Seconds between two checks that the client is still waiting
+DISCONNECT_POLL_INTERVAL = 0.1
+
+
+def warm_up_solver():
+    # Runs once in every worker, so that requests do not pay for the imports
+    # and the first calls into SciPy
+    from optimization.utils import compile_portfolio, run_optimization
+
+    portfolio = compile_portfolio(
+        [
+            {"name": "a", "class_name": "c", "value": 1.0},
+            {"name": "b", "class_name": "c", "value": 2.0},
+        ],
+        [
+            {"object_type": "asset_class", "object_name": "c", "rate": 1.0},
+            {"object_type": "asset", "object_name": "a", "rate": 0.5},
+            {"object_type": "asset", "object_name": "b", "rate": 0.5},
+        ],
+    )
+    run_optimization(portfolio, [], 10)
+
+
+class SolverError(Exception):
+    # Carries an HTTPException back from a worker, which cannot be pickled
+    def __init__(self, status_code: int, detail: str, records: list):
+        super().__init__(status_code, detail, records)
+        self.status_code = status_code
+        self.detail = detail
+        self.records = records
+
+
+def call_solver(function: Callable, *args) -> tuple:
+    # Returns the result along with the measures taken while solving
+    collect_records()
+    try:
+        return function(*args), collect_records()
+    except HTTPException as exception:
+        raise SolverError(
+            exception.status_code, exception.detail, collect_records()
+        )
+
+
+_pool: ProcessPoolExecutor | None = None
+_pending_solves = 0
+_pending_lock = threading.Lock()
+
+
+def start_solver_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Spawned rather than forked, the API process runs threads and an
+        # event loop that children should not inherit
+        _pool = ProcessPoolExecutor(
+            max_workers=WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=warm_up_solver,
+        )
+        # Start every worker now instead of on the first requests
+        for _ in range(WORKERS):
+            _pool.submit(os.getpid)
+    return _pool
+
+
+def stop_solver_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def release_solve(future: Future):
+    global _pending_solves
+    with _pending_lock:
+        _pending_solves -= 1
+    if future is None or future.cancelled():
+        return
+    exception = future.exception()
+    if exception is None:
+        observe_records(future.result()[1])
+    elif isinstance(exception, SolverError):
+        observe_records(exception.records)
+
+
+def get_solve_result(future: Future):
+    return future.result()[0]
+
+
+def submit_solve(function: Callable, *args) -> Future:
+    global _pending_solves
+    with _pending_lock:
+        if _pending_solves >= MAX_PENDING_SOLVES:
+            raise HTTPException(
+                status_code=429, detail="Too many optimizations running"
+            )
+        _pending_solves += 1
+    try:
+        future = start_solver_pool().submit(call_solver, function, *args)
+    except Exception:
+        release_solve(None)
+        raise
+    future.add_done_callback(release_solve)
+    return future
+
+
+async def run_solve(request: Request, function: Callable, *args):
+    # Waits for the solve, giving up on it when the client goes away
+    future = submit_solve(function, *args)
+    result = asyncio.wrap_future(future)
+    while True:
+        done, _ = await asyncio.wait(
+            {result}, timeout=DISCONNECT_POLL_INTERVAL
+        )
+        if done:
+            try:
+                return result.result()[0]
+            except SolverError as exception:
+                raise HTTPException(
+                    status_code=exception.status_code, detail=exception.detail
+                )
+        if await request.is_disconnected():
+            future.cancel()
+            logging.info("Client disconnected, optimization abandoned")
+            raise HTTPException(status_code=499, detail="Client disconnected")
+
+
+@dataclass
+class Job:
+    session_id: str
+    future: Future
+    cache_key: tuple
+    created: float = field(default_factory=time.monotonic)
+    cancelled: bool = False
+
+
+_jobs: dict[str, Job] = {}
+_jobs_lock = threading.Lock()
+
+
+def prune_jobs():
+    now = time.monotonic()
+    with _jobs_lock:
+        for job_id, job in list(_jobs.items()):
+            if job.future.done() and now - job.created > JOB_TTL_SECONDS:
+                del _jobs[job_id]
+
+
+def add_job(session_id: str, future: Future, cache_key: tuple) -> str:
+    prune_jobs()
+    job_id = uuid.uuid4().hex
+    with _jobs_lock:
+        _jobs[job_id] = Job(session_id, future, cache_key)
+    return job_id
+
+
+def submit_job(
+    session_id: str, cache_key: tuple, function: Callable, *args
+) -> str:
+    future = submit_solve(function, *args)
+
+    def store_result(future: Future):
+        if not future.cancelled() and future.exception() is None:
+            cache_result(cache_key, get_solve_result(future))
+
+    future.add_done_callback(store_result)
+    return add_job(session_id, future, cache_key)
+
+
+def add_finished_job(session_id: str, cache_key: tuple, result: dict) -> str:
+    future = Future()
+    future.set_result((result, []))
+    return add_job(session_id, future, cache_key)
+
+
+def get_job(job_id: str, session_id: str) -> Job:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None or job.session_id != session_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+def describe_job(job: Job) -> dict:
+    if job.cancelled or job.future.cancelled():
+        return {"status": "cancelled"}
+    if job.future.running():
+        return {"status": "running"}
+    if not job.future.done():
+        return {"status": "pending"}
+
+    exception = job.future.exception()
+    if isinstance(exception, SolverError):
+        return {"status": "failed", "detail": exception.detail}
+    if exception is not None:
+        logging.error(f"Optimization job failed: {exception!r}")
+        return {"status": "failed", "detail": "Optimization failed"}
+    return {"status": "done", "result": get_solve_result(job.future)}
+
+
+def cancel_job(job: Job):
+    # A solve already running in a worker cannot be interrupted, its result
+    # is dropped instead
+    job.cancelled = True
+    job.future.cancel()
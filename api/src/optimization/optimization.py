@@ -1,40 +1,313 @@
-from fastapi import APIRouter, Cookie, HTTPException
+import asyncio
+
+import numpy as np
+import yaml
+
+from fastapi import APIRouter, Cookie, HTTPException, Query, Request
 from mongo.allocation import get_allocation_collection
-from mongo.assets import get_assets_collection
+from mongo.assets import get_assets_collection, update_asset_values
 from mongo.constraints import get_constraints_collection
-from optimization.utils import format_result, run_optimization, score_function
+from metrics import OPTIMIZATION_PHASE_LATENCY, phase_timer, record_solve
+from mongo.models import TransferPlan
+from optimization.cache import (
+    cache_result,
+    get_cached_result,
+    make_fingerprint,
+)
+from optimization.integer import (
+    round_continuous_transfer,
+    run_integer_optimization,
+)
+from optimization.jobs import (
+    add_finished_job,
+    cancel_job,
+    describe_job,
+    get_job,
+    run_solve,
+    submit_job,
+)
+from optimization.utils import (
+    Portfolio,
+    compile_portfolio,
+    format_result,
+    run_optimization,
+    score_function,
+)
 
 
 optimization_router = APIRouter(prefix="/optimization", tags=["optimization"])
 
+with open("/conf/project_config.yml", "r") as f:
+    PROJECT_CONFIG = yaml.safe_load(f)
 
-@optimization_router.get("/")
-def route_optimize(total_amount: int, session_id: str = Cookie()) -> dict:
-    assets = list(get_assets_collection(session_id).find())
-    allocation = list(get_allocation_collection(session_id).find())
-    constraints = list(get_constraints_collection(session_id).find())
+# Longest branch and bound a request may hold a solver process for
+MAX_TIME_BUDGET = PROJECT_CONFIG.get("optimization", {}).get(
+    "max_time_budget_seconds", 10
+)
+
+
+async def load_problem(
+    session_id: str,
+) -> tuple[list[dict], list[dict], list[dict]]:
+    assets, allocation, constraints = await asyncio.gather(
+        get_assets_collection(session_id).find().to_list(None),
+        get_allocation_collection(session_id).find().to_list(None),
+        get_constraints_collection(session_id).find().to_list(None),
+    )
 
     if not assets or not allocation:
-        print("BAD")
         raise HTTPException(
             status_code=400, detail="Missing assets or allocation"
         )
+    return assets, allocation, constraints
 
-    result = run_optimization(
-        assets=assets,
-        allocation=allocation,
-        constraints=constraints,
-        total_amount=total_amount,
-    )
 
+def compile_problem(assets: list[dict], allocation: list[dict]) -> Portfolio:
+    try:
+        return compile_portfolio(assets, allocation)
+    except ValueError as exception:
+        raise HTTPException(status_code=400, detail=str(exception))
+
+
+def make_plan(transfer: np.ndarray, portfolio: Portfolio) -> dict:
+    transfer = transfer.astype(int).tolist()
+    return {
+        "results": format_result(transfer, portfolio),
+        "score": score_function(transfer, portfolio),
+    }
+
+
+def optimize(
+    assets: list[dict],
+    allocation: list[dict],
+    constraints: list[dict],
+    total_amount: int,
+    integer: bool = False,
+    lot_size: int = 1,
+    min_transfer: float = 0,
+    time_budget: float = 1.0,
+) -> dict:
+    with phase_timer("build"):
+        portfolio = compile_problem(assets, allocation)
+    try:
+        with phase_timer("solve"):
+            if integer:
+                result = run_integer_optimization(
+                    portfolio=portfolio,
+                    constraints=constraints,
+                    total_amount=total_amount,
+                    lot_size=lot_size,
+                    min_transfer=min_transfer,
+                    time_budget=time_budget,
+                )
+            else:
+                result = run_optimization(
+                    portfolio=portfolio,
+                    constraints=constraints,
+                    total_amount=total_amount,
+                )
+    except ValueError as exception:
+        raise HTTPException(status_code=400, detail=str(exception))
+
+    record_solve("integer" if integer else "continuous", result)
     if not result.success:
-        raise HTTPException(status_code=500)
+        raise HTTPException(status_code=500, detail=result.message)
+
+    with phase_timer("format"):
+        transfer = result.x
+        if not integer:
+            transfer = round_continuous_transfer(
+                transfer, portfolio, constraints, total_amount
+            )
+        response = make_plan(transfer, portfolio)
+    if integer:
+        response["gap"] = result.gap
+    return response
+
+
+def sweep(
+    assets: list[dict],
+    allocation: list[dict],
+    constraints: list[dict],
+    total_amounts: list[int],
+) -> dict:
+    with phase_timer("build"):
+        portfolio = compile_problem(assets, allocation)
+    plans = []
+    previous_transfer, previous_amount = None, 0
+    for total_amount in total_amounts:
+        # Warm start from the previous plan, rescaled to the new amount
+        initial_transfer = None
+        if previous_transfer is not None and previous_amount > 0:
+            initial_transfer = (
+                previous_transfer * max(total_amount, 0) / previous_amount
+            )
+
+        try:
+            with phase_timer("solve"):
+                result = run_optimization(
+                    portfolio=portfolio,
+                    constraints=constraints,
+                    total_amount=total_amount,
+                    initial_transfer=initial_transfer,
+                )
+        except ValueError as exception:
+            raise HTTPException(status_code=400, detail=str(exception))
+
+        record_solve("continuous", result)
+        if not result.success:
+            plans.append(
+                {"total_amount": total_amount, "error": result.message}
+            )
+            continue
+
+        with phase_timer("format"):
+            plan = make_plan(
+                round_continuous_transfer(
+                    result.x, portfolio, constraints, total_amount
+                ),
+                portfolio,
+            )
+        plans.append({"total_amount": total_amount, **plan})
+        previous_transfer, previous_amount = result.x, total_amount
+
+    return {"plans": plans}
+
+
+async def load_optimization(
+    session_id: str,
+    total_amount: int,
+    integer: bool,
+    lot_size: int,
+    min_transfer: float,
+    time_budget: float,
+) -> tuple[tuple, tuple]:
+    # Returns the cache key of the optimization and the arguments of optimize
+    with OPTIMIZATION_PHASE_LATENCY.labels("fetch").time():
+        assets, allocation, constraints = await load_problem(session_id)
 
-    transfer = result.x.astype(int).tolist()
+    cache_key = (
+        session_id,
+        make_fingerprint(assets, allocation, constraints),
+        total_amount,
+        (lot_size, min_transfer, time_budget) if integer else None,
+    )
+    arguments = (
+        assets,
+        allocation,
+        constraints,
+        total_amount,
+        integer,
+        lot_size,
+        min_transfer,
+        time_budget,
+    )
+    return cache_key, arguments
+
+
+@optimization_router.get("/")
+async def route_optimize(
+    request: Request,
+    total_amount: int,
+    integer: bool = False,
+    lot_size: int = Query(1, ge=1),
+    min_transfer: float = Query(0, ge=0),
+    time_budget: float = Query(1.0, gt=0, le=MAX_TIME_BUDGET),
+    session_id: str = Cookie(),
+) -> dict:
+    cache_key, arguments = await load_optimization(
+        session_id, total_amount, integer, lot_size, min_transfer, time_budget
+    )
+    cached_response = get_cached_result(cache_key)
+    if cached_response is not None:
+        return {**cached_response, "cached": True}
+
+    # Solving is CPU bound, it runs in the solver processes
+    response = await run_solve(request, optimize, *arguments)
+    cache_result(cache_key, response)
+    return {**response, "cached": False}
+
+
+@optimization_router.post("/jobs")
+async def route_submit_optimization(
+    total_amount: int,
+    integer: bool = False,
+    lot_size: int = Query(1, ge=1),
+    min_transfer: float = Query(0, ge=0),
+    time_budget: float = Query(1.0, gt=0, le=MAX_TIME_BUDGET),
+    session_id: str = Cookie(),
+) -> dict:
+    cache_key, arguments = await load_optimization(
+        session_id, total_amount, integer, lot_size, min_transfer, time_budget
+    )
+    cached_response = get_cached_result(cache_key)
+    if cached_response is not None:
+        job_id = add_finished_job(session_id, cache_key, cached_response)
+    else:
+        job_id = submit_job(session_id, cache_key, optimize, *arguments)
+    return {"job_id": job_id}
+
+
+@optimization_router.get("/jobs/{job_id}")
+async def route_get_optimization(
+    job_id: str, session_id: str = Cookie()
+) -> dict:
+    return describe_job(get_job(job_id, session_id))
 
-    formatted_results = format_result(transfer, assets, allocation)
 
+@optimization_router.delete("/jobs/{job_id}")
+async def route_cancel_optimization(
+    job_id: str, session_id: str = Cookie()
+) -> dict:
+    job = get_job(job_id, session_id)
+    cancel_job(job)
+    return describe_job(job)
+
+
+@optimization_router.get("/sweep")
+async def route_optimize_sweep(
+    request: Request,
+    total_amounts: list[int] = Query(),
+    session_id: str = Cookie(),
+) -> dict:
+    with OPTIMIZATION_PHASE_LATENCY.labels("fetch").time():
+        assets, allocation, constraints = await load_problem(session_id)
+
+    cache_key = (
+        session_id,
+        make_fingerprint(assets, allocation, constraints),
+        tuple(total_amounts),
+        "sweep",
+    )
+    cached_response = get_cached_result(cache_key)
+    if cached_response is not None:
+        return {**cached_response, "cached": True}
+
+    response = await run_solve(
+        request, sweep, assets, allocation, constraints, total_amounts
+    )
+    cache_result(cache_key, response)
+    return {**response, "cached": False}
+
+
+@optimization_router.post("/apply")
+async def route_apply_transfers(
+    plan: TransferPlan, session_id: str = Cookie()
+) -> dict:
+    assets = [
+        {"name": transfer.asset_name, "value": transfer.new_value}
+        for transfer in plan.asset_transfers
+    ]
+    if not assets:
+        return {"matched": 0, "modified": 0}
+
+    result = await update_asset_values(assets, session_id)
+    if result.matched_count < len(assets):
+        raise HTTPException(
+            status_code=400,
+            detail=f"{len(assets) - result.matched_count} assets do not exist",
+        )
     return {
-        "results": formatted_results,
-        "score": score_function(transfer, assets, allocation),
+        "matched": result.matched_count,
+        "modified": result.modified_count,
     }
@@ -1,203 +1,680 @@
+from dataclasses import dataclass
+
 import numpy as np
 
-from scipy.optimize import LinearConstraint, OptimizeResult, minimize
+from scipy.optimize import Bounds, LinearConstraint, OptimizeResult, minimize
+from scipy.sparse import csr_matrix
+
+
+# Methods of scipy.optimize.minimize making use of a Hessian-vector product
+HESSIAN_METHODS = ("Newton-CG", "trust-ncg", "trust-krylov", "trust-constr")
+
+
+@dataclass
+class Portfolio:
+    asset_names: list[str]
+    asset_positions: dict[str, int]
+    class_names: list[str]
+    values: np.ndarray
+    class_index: np.ndarray
+    asset_targets: np.ndarray
+    class_targets: np.ndarray
+
+    @property
+    def n_assets(self) -> int:
+        return len(self.asset_names)
+
+    @property
+    def n_classes(self) -> int:
+        return len(self.class_names)
+
 
+def find_target_rate(object_name: str, statements: dict[str, dict]) -> float:
+    statement = statements.get(object_name)
+    if statement is None or statement.get("rate") is None:
+        raise ValueError(f"No target allocation for {object_name}")
+    return statement["rate"]
 
-def find_allocation_statement(
-    object_name: str, allocation: list[dict]
-) -> dict | None:
+
+def compile_portfolio(assets: list[dict], allocation: list[dict]) -> Portfolio:
+    statements = {}
     for statement in allocation:
-        if statement["object_name"] == object_name:
-            return statement
+        statements.setdefault(statement["object_name"], statement)
 
+    asset_positions = {}
+    for i, asset in enumerate(assets):
+        asset_positions.setdefault(asset["name"], i)
 
-def compute_asset_rate(
-    transfer: np.array, assets: list[dict], index: int
-) -> float:
-    asset = assets[index]
-    asset_class = asset["class_name"]
-    total_class = np.sum(
-        [
-            asset["value"] + transfer[i]
-            for i, asset in enumerate(assets)
-            if asset["class_name"] == asset_class
-        ]
+    class_names = []
+    class_positions = {}
+    class_index = np.empty(len(assets), dtype=np.intp)
+    for i, asset in enumerate(assets):
+        asset_class = asset["class_name"]
+        if asset_class not in class_positions:
+            class_positions[asset_class] = len(class_names)
+            class_names.append(asset_class)
+        class_index[i] = class_positions[asset_class]
+
+    return Portfolio(
+        asset_names=[asset["name"] for asset in assets],
+        asset_positions=asset_positions,
+        class_names=class_names,
+        values=np.array([asset["value"] for asset in assets], dtype=float),
+        class_index=class_index,
+        asset_targets=np.array(
+            [find_target_rate(asset["name"], statements) for asset in assets],
+            dtype=float,
+        ),
+        class_targets=np.array(
+            [
+                find_target_rate(asset_class, statements)
+                for asset_class in class_names
+            ],
+            dtype=float,
+        ),
+    )
+
+
+def compute_class_totals(
+    transfer: np.ndarray, portfolio: Portfolio
+) -> np.ndarray:
+    return np.bincount(
+        portfolio.class_index,
+        weights=portfolio.values + transfer,
+        minlength=portfolio.n_classes,
     )
 
-    rate = (asset["value"] + transfer[index]) / total_class
-    return rate
 
+def compute_asset_rates(
+    transfer: np.ndarray, portfolio: Portfolio
+) -> np.ndarray:
+    new_values = portfolio.values + transfer
+    class_totals = compute_class_totals(transfer, portfolio)
+    return new_values / class_totals[portfolio.class_index]
+
+
+def compute_asset_class_rates(
+    transfer: np.ndarray, portfolio: Portfolio
+) -> np.ndarray:
+    class_totals = compute_class_totals(transfer, portfolio)
+    return class_totals / np.sum(portfolio.values + transfer)
 
-def compute_asset_class_rate(
-    transfer: np.array, assets: list[dict], asset_class: str
+
+def compute_assets_score(transfer: np.ndarray, portfolio: Portfolio) -> float:
+    asset_rates = compute_asset_rates(transfer, portfolio)
+    return np.sum((asset_rates - portfolio.asset_targets) ** 2)
+
+
+def compute_asset_classes_score(
+    transfer: np.ndarray, portfolio: Portfolio
 ) -> float:
-    total = np.sum(
-        [asset["value"] + transfer[i] for i, asset in enumerate(assets)]
+    class_rates = compute_asset_class_rates(transfer, portfolio)
+    return np.sum((class_rates - portfolio.class_targets) ** 2)
+
+
+def score_function(transfer: np.ndarray, portfolio: Portfolio) -> float:
+    transfer = np.asarray(transfer, dtype=float)
+    assets_score = compute_assets_score(transfer, portfolio)
+    asset_classes_score = compute_asset_classes_score(transfer, portfolio)
+    return 1000 * (assets_score + asset_classes_score)
+
+
+def score_gradient(transfer: np.ndarray, portfolio: Portfolio) -> np.ndarray:
+    transfer = np.asarray(transfer, dtype=float)
+    new_values = portfolio.values + transfer
+    class_totals = compute_class_totals(transfer, portfolio)
+    total = np.sum(class_totals)
+
+    # d(x_i / S_c) / dx_j = (delta_ij - r_i) / S_c for assets of the same class
+    asset_rates = new_values / class_totals[portfolio.class_index]
+    asset_deviations = asset_rates - portfolio.asset_targets
+    class_means = np.bincount(
+        portfolio.class_index,
+        weights=asset_deviations * asset_rates,
+        minlength=portfolio.n_classes,
+    )
+    assets_gradient = (
+        2
+        * (asset_deviations - class_means[portfolio.class_index])
+        / class_totals[portfolio.class_index]
     )
-    total_class = np.sum(
-        [
-            asset["value"] + transfer[i]
-            for i, asset in enumerate(assets)
-            if asset["class_name"] == asset_class
-        ]
+
+    class_rates = class_totals / total
+    class_deviations = class_rates - portfolio.class_targets
+    classes_gradient = (
+        2 * (class_deviations - np.sum(class_deviations * class_rates)) / total
     )
-    return total_class / total
 
+    return 1000 * (assets_gradient + classes_gradient[portfolio.class_index])
 
-def compute_assets_score(
-    transfer: np.array, assets: list[dict], allocation: list[dict]
-) -> float:
-    assets_score = 0
-    for k in range(len(assets)):
-        actual_rate = compute_asset_rate(transfer, assets, k)
-        target_rate = find_allocation_statement(assets[k]["name"], allocation)[
-            "rate"
-        ]
-        assets_score += (actual_rate - target_rate) ** 2
-    return assets_score
 
+def _ratio_hessian_product(
+    rates: np.ndarray,
+    deviations: np.ndarray,
+    totals: np.ndarray,
+    vector: np.ndarray,
+    groups: np.ndarray,
+    n_groups: int,
+) -> np.ndarray:
+    # Hessian of sum_i (x_i / S_g(i) - target_i) ** 2 where S_g sums its group:
+    # H_jk = 2 / S_g ** 2 * (delta_jk - (d_j + r_j) - (d_k + r_k) + m_g + q_g)
+    def group_sum(weights):
+        return np.bincount(groups, weights=weights, minlength=n_groups)
 
-def compute_asset_classes_score(
-    transfer: np.array, assets: list[dict], allocation: list[dict]
-) -> float:
-    asset_classes = set([asset["class_name"] for asset in assets])
-    asset_classes_score = 0
-    for asset_class in asset_classes:
-        actual_rate = compute_asset_class_rate(transfer, assets, asset_class)
-        target_rate = find_allocation_statement(asset_class, allocation)[
-            "rate"
-        ]
-        asset_classes_score += (actual_rate - target_rate) ** 2
-    return asset_classes_score
-
-
-def score_function(
-    transfer: np.array, assets: list[dict], allocation: list[dict]
-) -> float:
-    assets_score = compute_assets_score(transfer, assets, allocation)
-    asset_classes_score = compute_asset_classes_score(
-        transfer, assets, allocation
+    shifted = deviations + rates
+    offsets = group_sum(deviations * rates) + group_sum(rates * shifted)
+    vector_sums = group_sum(vector)
+    weighted_sums = group_sum(shifted * vector)
+    return (
+        2
+        * (
+            vector
+            - (shifted - offsets[groups]) * vector_sums[groups]
+            - weighted_sums[groups]
+        )
+        / totals[groups] ** 2
     )
-    return 1000 * (assets_score + asset_classes_score)
 
 
-def get_asset_index(asset_name: str, assets: list[dict]) -> int | None:
-    for i, asset in enumerate(assets):
-        if asset["name"] == asset_name:
-            return i
+def score_hessian_product(
+    transfer: np.ndarray, vector: np.ndarray, portfolio: Portfolio
+) -> np.ndarray:
+    transfer = np.asarray(transfer, dtype=float)
+    vector = np.asarray(vector, dtype=float)
+    new_values = portfolio.values + transfer
+    class_totals = compute_class_totals(transfer, portfolio)
+    total = np.sum(class_totals)
+
+    asset_rates = new_values / class_totals[portfolio.class_index]
+    assets_product = _ratio_hessian_product(
+        asset_rates,
+        asset_rates - portfolio.asset_targets,
+        class_totals,
+        vector,
+        portfolio.class_index,
+        portfolio.n_classes,
+    )
+
+    # Class rates only depend on the transfers through the class totals
+    class_rates = class_totals / total
+    class_vector = np.bincount(
+        portfolio.class_index, weights=vector, minlength=portfolio.n_classes
+    )
+    classes_product = _ratio_hessian_product(
+        class_rates,
+        class_rates - portfolio.class_targets,
+        np.array([total]),
+        class_vector,
+        np.zeros(portfolio.n_classes, dtype=np.intp),
+        1,
+    )
+
+    return 1000 * (assets_product + classes_product[portfolio.class_index])
+
+
+def get_asset_index(asset_name: str, portfolio: Portfolio) -> int | None:
+    return portfolio.asset_positions.get(asset_name)
 
 
 def create_optimization_constraints(
-    constraints: list[dict], assets: list[dict]
-) -> list[LinearConstraint]:
-    optimization_constraints = []
-    for constraint in constraints:
-        matrix = np.zeros((1, len(assets)))
-        for asset in constraint["assets"]:
-            matrix[0, get_asset_index(asset["asset_name"], assets)] = asset[
-                "coef"
-            ]
+    constraints: list[dict], portfolio: Portfolio, total_amount: float
+) -> LinearConstraint:
+    rows, columns, coefs = [], [], []
+    lower_bounds = np.full(len(constraints) + 1, -np.inf)
+    upper_bounds = np.full(len(constraints) + 1, np.inf)
 
-        if constraint["operator"] == "eq":
-            optimization_constraints.append(
-                LinearConstraint(
-                    matrix,
-                    lb=constraint["value"],
-                    ub=constraint["value"],
-                )
-            )
-        if constraint["operator"] == "leq":
-            optimization_constraints.append(
-                LinearConstraint(
-                    matrix,
-                    ub=constraint["value"],
-                )
-            )
-        if constraint["operator"] == "geq":
-            optimization_constraints.append(
-                LinearConstraint(
-                    matrix,
-                    lb=constraint["value"],
+    for row, constraint in enumerate(constraints):
+        for asset in constraint["assets"]:
+            index = get_asset_index(asset["asset_name"], portfolio)
+            if index is None:
+                raise ValueError(
+                    f"Constraint refers to unknown asset {asset['asset_name']}"
                 )
-            )
-    return optimization_constraints
+            rows.append(row)
+            columns.append(index)
+            coefs.append(asset["coef"])
 
+        if constraint["operator"] in ("eq", "geq"):
+            lower_bounds[row] = constraint["value"]
+        if constraint["operator"] in ("eq", "leq"):
+            upper_bounds[row] = constraint["value"]
 
-def make_amount_constraint(
-    total_amount: int, assets: list[dict]
-) -> LinearConstraint:
-    return LinearConstraint(
-        np.ones((1, len(assets))),
-        lb=total_amount,
-        ub=total_amount,
+    # The transfers must add up to the amount to invest
+    amount_row = len(constraints)
+    rows.extend([amount_row] * portfolio.n_assets)
+    columns.extend(range(portfolio.n_assets))
+    coefs.extend([1.0] * portfolio.n_assets)
+    lower_bounds[amount_row] = total_amount
+    upper_bounds[amount_row] = total_amount
+
+    matrix = csr_matrix(
+        (coefs, (rows, columns)),
+        shape=(len(constraints) + 1, portfolio.n_assets),
     )
+    return LinearConstraint(matrix, lb=lower_bounds, ub=upper_bounds)
 
 
-def make_positive_constraint(assets: list[dict]) -> LinearConstraint:
-    return LinearConstraint(
-        np.eye(len(assets)),
-        lb=0,
+def make_positive_bounds(portfolio: Portfolio) -> Bounds:
+    return Bounds(
+        np.zeros(portfolio.n_assets), np.full(portfolio.n_assets, np.inf)
     )
 
 
-def run_optimization(
-    assets: list[dict],
-    allocation: list[dict],
-    constraints: list[dict],
+def check_bounds(bounds: Bounds, total_amount: float) -> str | None:
+    if np.any(bounds.lb > bounds.ub):
+        return "Some transfers have a lower bound above their upper bound"
+    if np.sum(bounds.lb) > total_amount or np.sum(bounds.ub) < total_amount:
+        return "The transfer bounds cannot add up to the amount to invest"
+
+
+def project_on_capped_simplex(
+    target: np.ndarray, lower: np.ndarray, upper: np.ndarray, total: float
+) -> tuple[np.ndarray, float]:
+    # Water-filling: the closest point to target with lower <= x <= upper
+    # and sum(x) == total is clip(target - level, lower, upper) for the
+    # level at which the clipped values add up to total
+    def filled(level):
+        return np.sum(np.clip(target - level, lower, upper))
+
+    unbounded = ~np.isfinite(upper)
+    breakpoints = np.unique(
+        np.concatenate([target - lower, (target - upper)[~unbounded]])
+    )
+
+    if filled(breakpoints[0]) < total:
+        # Above every cap, only the uncapped entries keep filling up
+        level = breakpoints[0] - (total - filled(breakpoints[0])) / max(
+            np.count_nonzero(unbounded), 1
+        )
+        return np.clip(target - level, lower, upper), level
+
+    start, end = 0, len(breakpoints) - 1
+    while end - start > 1:
+        middle = (start + end) // 2
+        if filled(breakpoints[middle]) >= total:
+            start = middle
+        else:
+            end = middle
+
+    start_fill, end_fill = filled(breakpoints[start]), filled(breakpoints[end])
+    if start_fill == end_fill:
+        level = breakpoints[start]
+    else:
+        level = breakpoints[start] + (start_fill - total) / (
+            start_fill - end_fill
+        ) * (breakpoints[end] - breakpoints[start])
+    return np.clip(target - level, lower, upper), level
+
+
+def fill_asset_class(
+    class_total: float,
+    targets: np.ndarray,
+    lower: np.ndarray,
+    upper: np.ndarray,
+) -> tuple[np.ndarray, float, float]:
+    # Best values of the assets of a class once its total is fixed, along
+    # with the assets score and its derivative with respect to the total
+    new_values, level = project_on_capped_simplex(
+        targets * class_total, lower, upper, class_total
+    )
+    rates = new_values / class_total
+    score = np.sum((rates - targets) ** 2)
+
+    # Envelope theorem, the clipped assets keep their values: the multiplier
+    # of sum(x) == S is 2 * (rate - target) / S for every free asset. When
+    # none is free, it comes from the first asset the total would free
+    movable = ~np.isclose(new_values, upper, rtol=1e-9, atol=1e-9)
+    if not movable.any():
+        movable = np.ones(len(targets), dtype=bool)
+    multiplier = 2 * np.min((rates - targets)[movable]) / class_total
+    derivative = (
+        multiplier
+        - 2 * np.sum((rates - targets) * new_values) / class_total**2
+    )
+    return new_values, score, derivative
+
+
+def fill_portfolio(
+    class_rates: np.ndarray,
+    portfolio: Portfolio,
+    total: float,
+    lower: np.ndarray,
+    upper: np.ndarray,
+) -> tuple[np.ndarray, float, np.ndarray]:
+    new_values = np.empty(portfolio.n_assets)
+    score = np.sum((class_rates - portfolio.class_targets) ** 2)
+    gradient = 2 * (class_rates - portfolio.class_targets)
+    for c in range(portfolio.n_classes):
+        members = portfolio.class_index == c
+        values, class_score, derivative = fill_asset_class(
+            class_rates[c] * total,
+            portfolio.asset_targets[members],
+            lower[members],
+            upper[members],
+        )
+        new_values[members] = values
+        score += class_score
+        gradient[c] += total * derivative
+    return new_values, score, gradient
+
+
+def search_class_totals(
+    portfolio: Portfolio,
+    total: float,
+    lower: np.ndarray,
+    upper: np.ndarray,
+    n_steps: int = 64,
+) -> np.ndarray:
+    # Coarse global search of the class totals: the score is a sum of one
+    # term per class under the single constraint that the totals add up,
+    # a dynamic program over totals in steps of total / n_steps finds the
+    # best split on that grid, whatever the local minima of the terms
+    step = total / n_steps
+    costs = np.full((portfolio.n_classes, n_steps + 1), np.inf)
+    for c in range(portfolio.n_classes):
+        members = portfolio.class_index == c
+        class_lower, class_upper = np.sum(lower[members]), np.sum(
+            upper[members]
+        )
+        for j in range(n_steps + 1):
+            if not class_lower - step < j * step < class_upper + step:
+                continue
+            class_total = np.clip(j * step, class_lower, class_upper)
+            costs[c, j] = (
+                class_total / total - portfolio.class_targets[c]
+            ) ** 2
+            if members.any() and class_total > 0:
+                costs[c, j] += fill_asset_class(
+                    class_total,
+                    portfolio.asset_targets[members],
+                    lower[members],
+                    upper[members],
+                )[1]
+
+    # best[m] is the lowest cost of the classes so far adding up to m steps
+    best = costs[0]
+    choices = []
+    for c in range(1, portfolio.n_classes):
+        combined = np.empty(n_steps + 1)
+        choice = np.empty(n_steps + 1, dtype=np.intp)
+        for m in range(n_steps + 1):
+            candidates = best[m::-1] + costs[c, : m + 1]
+            choice[m] = np.argmin(candidates)
+            combined[m] = candidates[choice[m]]
+        best = combined
+        choices.append(choice)
+
+    steps = np.empty(portfolio.n_classes, dtype=np.intp)
+    remaining = n_steps
+    for c in range(portfolio.n_classes - 1, 0, -1):
+        steps[c] = choices[c - 1][remaining]
+        remaining -= steps[c]
+    steps[0] = remaining
+
+    class_lower = np.bincount(
+        portfolio.class_index, weights=lower, minlength=portfolio.n_classes
+    )
+    class_upper = np.bincount(
+        portfolio.class_index, weights=upper, minlength=portfolio.n_classes
+    )
+    return np.clip(steps * step, class_lower, class_upper)
+
+
+def run_water_filling(
+    portfolio: Portfolio,
     total_amount: float,
+    bounds: Bounds | None = None,
+    initial_transfer: np.ndarray | None = None,
 ) -> OptimizeResult:
-    initial_transfer = np.zeros(len(assets))
-    optimization_constraints = create_optimization_constraints(
-        constraints, assets
+    # With the amount to invest fixed, the portfolio total is a constant and
+    # the class rates are linear in the transfers. Once the class totals are
+    # chosen, the best assets values of each class are a projection on a
+    # capped simplex, so only the few class totals are left to optimize.
+    bounds = bounds or make_positive_bounds(portfolio)
+    message = check_bounds(bounds, total_amount)
+    if message:
+        return OptimizeResult(
+            x=np.zeros(portfolio.n_assets), success=False, message=message
+        )
+
+    lower = portfolio.values + bounds.lb
+    upper = portfolio.values + bounds.ub
+    total = np.sum(portfolio.values) + total_amount
+    if total <= 0:
+        return OptimizeResult(
+            x=np.zeros(portfolio.n_assets),
+            success=False,
+            message="The portfolio is empty",
+        )
+
+    class_lower = np.bincount(
+        portfolio.class_index, weights=lower, minlength=portfolio.n_classes
+    )
+    class_upper = np.bincount(
+        portfolio.class_index, weights=upper, minlength=portfolio.n_classes
+    )
+    # An empty class has no rate, keep it slightly above zero
+    rate_bounds = Bounds(
+        np.maximum(class_lower / total, 1e-9),
+        np.minimum(class_upper / total, 1),
+    )
+    if initial_transfer is None:
+        initial_rates = np.maximum(
+            class_lower / total, portfolio.class_targets
+        )
+    else:
+        initial_rates = compute_asset_class_rates(initial_transfer, portfolio)
+    initial_rates = np.clip(initial_rates, rate_bounds.lb, rate_bounds.ub)
+
+    def objective(class_rates):
+        _, score, gradient = fill_portfolio(
+            class_rates, portfolio, total, lower, upper
+        )
+        return score, gradient
+
+    res = minimize(
+        objective,
+        initial_rates,
+        method="SLSQP",
+        jac=True,
+        bounds=rate_bounds,
+        constraints=[
+            LinearConstraint(np.ones((1, portfolio.n_classes)), lb=1, ub=1)
+        ],
+        options={"ftol": 1e-12},
+    )
+    new_values, score, _ = fill_portfolio(
+        res.x, portfolio, total, lower, upper
     )
-    optimization_constraints.append(
-        make_amount_constraint(total_amount, assets)
+    res.x = new_values - portfolio.values
+    res.fun = 1000 * score
+    return res
+
+
+def scaled_score(
+    share: np.ndarray, portfolio: Portfolio, scale: float
+) -> float:
+    return score_function(scale * share, portfolio)
+
+
+def scaled_gradient(
+    share: np.ndarray, portfolio: Portfolio, scale: float
+) -> np.ndarray:
+    return scale * score_gradient(scale * share, portfolio)
+
+
+def scaled_hessian_product(
+    share: np.ndarray, vector: np.ndarray, portfolio: Portfolio, scale: float
+) -> np.ndarray:
+    return scale**2 * score_hessian_product(scale * share, vector, portfolio)
+
+
+def run_constrained_optimization(
+    portfolio: Portfolio,
+    constraints: list[dict],
+    total_amount: float,
+    initial_transfer: np.ndarray,
+    method: str = "SLSQP",
+    bounds: Bounds | None = None,
+) -> OptimizeResult:
+    # Solve for the share of the total amount sent to each asset, transfers
+    # in currency units make the problem far too badly scaled to converge
+    scale = total_amount if total_amount > 0 else 1
+    initial_share = initial_transfer / scale
+    linear_constraint = create_optimization_constraints(
+        constraints, portfolio, total_amount
     )
-    optimization_constraints.append(make_positive_constraint(assets))
+
+    # Equality and inequality rows are handed over separately, as SLSQP
+    # treats them as two different kinds of constraints anyway
+    equality_rows = linear_constraint.lb == linear_constraint.ub
+    optimization_constraints = [
+        LinearConstraint(
+            linear_constraint.A[rows],
+            lb=linear_constraint.lb[rows] / scale,
+            ub=linear_constraint.ub[rows] / scale,
+        )
+        for rows in (equality_rows, ~equality_rows)
+        if rows.any()
+    ]
+    bounds = bounds or make_positive_bounds(portfolio)
 
     res = minimize(
-        score_function,
-        initial_transfer,
-        args=(assets, allocation),
+        scaled_score,
+        initial_share,
+        args=(portfolio, scale),
+        method=method,
+        jac=scaled_gradient,
+        hessp=scaled_hessian_product if method in HESSIAN_METHODS else None,
+        bounds=Bounds(bounds.lb / scale, bounds.ub / scale),
         constraints=optimization_constraints,
     )
+    res.x = scale * res.x
     return res
 
 
-def format_result(
-    transfer: np.array, assets: list[dict], allocation: list[dict]
-) -> dict:
+def run_optimization(
+    portfolio: Portfolio,
+    constraints: list[dict],
+    total_amount: float,
+    method: str | None = None,
+    bounds: Bounds | None = None,
+    initial_transfer: np.ndarray | None = None,
+) -> OptimizeResult:
+    if bounds is not None and np.any(np.isfinite(bounds.ub)):
+        # An asset held at its cap makes the score of its class concave in
+        # the class total, the water-filling would stop at a wrong plan
+        message = check_bounds(bounds, total_amount)
+        if message:
+            return OptimizeResult(
+                x=np.zeros(portfolio.n_assets), success=False, message=message
+            )
+        if initial_transfer is not None:
+            initial_transfers = [initial_transfer]
+        else:
+            # The score has several local minima once capped, start from
+            # the best split of the class totals on a grid as well as from
+            # the best plan without the caps
+            lower = portfolio.values + bounds.lb
+            upper = portfolio.values + bounds.ub
+            total = np.sum(portfolio.values) + total_amount
+            class_totals = search_class_totals(portfolio, total, lower, upper)
+            new_values = lower.copy()
+            for c in range(portfolio.n_classes):
+                members = portfolio.class_index == c
+                if members.any() and class_totals[c] > 0:
+                    new_values[members] = fill_asset_class(
+                        class_totals[c],
+                        portfolio.asset_targets[members],
+                        lower[members],
+                        upper[members],
+                    )[0]
+            uncapped = run_water_filling(
+                portfolio,
+                total_amount,
+                Bounds(bounds.lb, np.full(portfolio.n_assets, np.inf)),
+            )
+            initial_transfers = [
+                project_on_capped_simplex(
+                    start, bounds.lb, bounds.ub, total_amount
+                )[0]
+                for start in (new_values - portfolio.values, uncapped.x)
+            ]
+    else:
+        unconstrained = run_water_filling(
+            portfolio, total_amount, bounds, initial_transfer
+        )
+        if not constraints or not unconstrained.success:
+            return unconstrained
+
+        # Without a better guess, start from the best allocation without
+        # user constraints, which already invests the right amount and is
+        # usually close to the constrained one
+        if initial_transfer is None:
+            initial_transfer = unconstrained.x
+        initial_transfers = [initial_transfer]
+
+    best = None
+    for initial_transfer in initial_transfers:
+        res = run_constrained_optimization(
+            portfolio,
+            constraints,
+            total_amount,
+            initial_transfer,
+            method or "SLSQP",
+            bounds,
+        )
+        if not res.success and method is None:
+            # The interior point method is slower but copes with the line
+            # search failures SLSQP sometimes runs into near active
+            # constraints
+            res = run_constrained_optimization(
+                portfolio,
+                constraints,
+                total_amount,
+                res.x,
+                "trust-constr",
+                bounds,
+            )
+        if best is None or (res.success, -res.fun) > (best.success, -best.fun):
+            best = res
+    return best
+
+
+def format_result(transfer: np.ndarray, portfolio: Portfolio) -> dict:
+    transfer_values = np.asarray(transfer).tolist()
+    no_transfer = np.zeros(portfolio.n_assets)
+    new_values = (portfolio.values + transfer_values).astype(int).tolist()
+
+    initial_asset_rates = compute_asset_rates(no_transfer, portfolio).tolist()
+    new_asset_rates = compute_asset_rates(transfer_values, portfolio).tolist()
     asset_transfers = [
         {
-            "asset_name": asset["name"],
-            "initial_value": asset["value"],
-            "transfer_value": transfer[i],
-            "new_value": int(asset["value"] + transfer[i]),
-            "initial_rate": compute_asset_rate(
-                np.zeros(len(assets)), assets, i
-            ),
-            "new_rate": compute_asset_rate(transfer, assets, i),
-            "target_rate": find_allocation_statement(
-                asset["name"], allocation
-            )["rate"],
+            "asset_name": asset_name,
+            "initial_value": portfolio.values[i].item(),
+            "transfer_value": transfer_values[i],
+            "new_value": new_values[i],
+            "initial_rate": initial_asset_rates[i],
+            "new_rate": new_asset_rates[i],
+            "target_rate": portfolio.asset_targets[i].item(),
         }
-        for i, asset in enumerate(assets)
+        for i, asset_name in enumerate(portfolio.asset_names)
     ]
-    unique_classes = set([asset["class_name"] for asset in assets])
+
+    initial_class_rates = compute_asset_class_rates(
+        no_transfer, portfolio
+    ).tolist()
+    new_class_rates = compute_asset_class_rates(
+        transfer_values, portfolio
+    ).tolist()
     class_rates = [
         {
             "class_name": asset_class,
-            "initial_rate": compute_asset_class_rate(
-                np.zeros(len(assets)), assets, asset_class
-            ),
-            "new_rate": compute_asset_class_rate(
-                transfer, assets, asset_class
-            ),
-            "target_rate": find_allocation_statement(asset_class, allocation)[
-                "rate"
-            ],
+            "initial_rate": initial_class_rates[c],
+            "new_rate": new_class_rates[c],
+            "target_rate": portfolio.class_targets[c].item(),
         }
-        for asset_class in unique_classes
+        for c, asset_class in enumerate(portfolio.class_names)
     ]
     return {
         "asset_transfers": asset_transfers,
@@ -3,7 +3,7 @@ import plotly.express as px
 import streamlit as st
 
 from utils import (
-    fetch_assets,
+    fetch_assets_summary,
     format_currency,
     load_asset_classes,
     export_data,
@@ -22,7 +22,11 @@ with open("/app/css/style.css") as f:
     st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
 
 
-assets = fetch_assets()
+summary = fetch_assets_summary()
+classes = {
+    asset_class["class_name"]: asset_class
+    for asset_class in summary["classes"]
+}
 
 
 def show_assets(assets: list[dict]):
@@ -39,21 +43,26 @@ def show_assets(assets: list[dict]):
                 pass
 
 
-def show_all_assets(assets: list[dict]):
+def show_all_assets(classes: dict[str, dict]):
     asset_classes = load_asset_classes()
     for asset_class in asset_classes:
         st.subheader(asset_class)
-        class_assets = [
-            asset for asset in assets if asset.get("class_name") == asset_class
-        ]
-        show_assets(class_assets)
-
-
-def show_classes_allocation(assets: list[dict]):
-    df = pd.DataFrame(assets)
+        if asset_class not in classes:
+            continue
+        show_assets(classes[asset_class]["assets"])
+        other = classes[asset_class]["other"]
+        if other["count"]:
+            st.write(
+                f"*And {other['count']} other assets, "
+                f"{format_currency(other['total'])}*"
+            )
+
+
+def show_classes_allocation(summary: dict):
+    df = pd.DataFrame(summary["classes"])
     pie = px.pie(
         df,
-        values="value",
+        values="total",
         names="class_name",
         title="Asset classes allocation",
         color_discrete_sequence=px.colors.sequential.dense,
@@ -61,18 +70,23 @@ def show_classes_allocation(assets: list[dict]):
     st.plotly_chart(pie)
 
 
-def show_assets_allocation(assets: list[dict]):
+def show_assets_allocation(classes: dict[str, dict]):
     asset_classes = load_asset_classes()
-    df = pd.DataFrame(assets)
     cols = st.columns(len(asset_classes))
     for col, asset_class in zip(cols, asset_classes):
         with col:
             with st.container():
-                df_asset_class = df[df["class_name"] == asset_class]
-                if df_asset_class.empty:
+                if asset_class not in classes:
                     st.write(f"**{asset_class}**")
                     st.write("No asset")
                 else:
+                    class_assets = classes[asset_class]["assets"]
+                    other = classes[asset_class]["other"]
+                    if other["count"]:
+                        class_assets = class_assets + [
+                            {"name": "Other", "value": other["total"]}
+                        ]
+                    df_asset_class = pd.DataFrame(class_assets)
                     pie = px.pie(
                         df_asset_class,
                         values="value",
@@ -104,7 +118,7 @@ st.write(
     unsafe_allow_html=True,
 )
 
-if assets:
+if summary["count"]:
     st.header("Your current assets")
     st.download_button(
         "Export your data",
@@ -115,12 +129,12 @@ if assets:
     if uploaded_file is not None:
         import_data(uploaded_file.getvalue().decode("utf-8"))
 
-    show_all_assets(assets)
+    show_all_assets(classes)
 
     st.header("Curent asset allocation")
-    show_classes_allocation(assets)
+    show_classes_allocation(summary)
 
-    show_assets_allocation(assets)
+    show_assets_allocation(classes)
 else:
     st.warning(
         "You don't have any asset yet. Add some by clicking on the **Manage your assets** tab"
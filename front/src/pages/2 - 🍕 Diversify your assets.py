@@ -1,20 +1,18 @@
 import requests
 import streamlit as st
 
-from utils import fetch_assets, load_asset_classes, make_request
+from utils import fetch_portfolio, load_asset_classes, make_request
 
 
 st.title("Diversify - 🍕 Diversify your assets")
 st.write("*Simple portfolio management app*")
 
 
-def get_rate(object_name: str) -> float | None:
-    endpoint = f"allocation/find/{object_name}"
+def get_rate(object_name: str, allocation: dict) -> float | None:
+    statement = allocation.get(object_name)
 
-    r = make_request(endpoint, method="GET").json()
-
-    if r:
-        return r["rate"]
+    if statement:
+        return statement["rate"]
 
 
 def save_rate(allocation: dict):
@@ -29,7 +27,7 @@ def save_rate(allocation: dict):
         st.error(f"Error saving allocation: {allocation, r.json()}", icon="❌")
 
 
-def make_classes_allocation():
+def make_classes_allocation(portfolio: dict):
     classes = load_asset_classes()
 
     st.subheader("Set your asset classes")
@@ -41,7 +39,7 @@ def make_classes_allocation():
         with cols[i]:
             asset_class = classes[i]
             st.write(f"**{asset_class}**")
-            current_rate = get_rate(asset_class)
+            current_rate = get_rate(asset_class, portfolio["allocation"])
             if current_rate is not None:
                 st.write(
                     f"*Current target allocation*: {current_rate*100:.0f} %"
@@ -75,10 +73,10 @@ def make_classes_allocation():
         )
 
 
-def make_assets_allocation():
+def make_assets_allocation(portfolio: dict):
     st.subheader("Set your assets")
 
-    assets = fetch_assets()
+    assets = portfolio["assets"]
 
     if not assets:
         st.warning("No assets found")
@@ -98,7 +96,9 @@ def make_assets_allocation():
                     with cols[i]:
                         asset = class_assets[i]
                         st.write(f"**{asset['name']}**")
-                        current_rate = get_rate(asset["name"])
+                        current_rate = get_rate(
+                            asset["name"], portfolio["allocation"]
+                        )
                         if current_rate is not None:
                             st.write(
                                 f"*Current allocation*: {current_rate*100:.0f} %"
@@ -160,9 +160,11 @@ def make_assets_allocation():
             )
 
 
+portfolio = fetch_portfolio()
+
 with st.expander("Manage your asset classes"):
-    make_classes_allocation()
+    make_classes_allocation(portfolio)
 
 
 with st.expander("Manage your assets"):
-    make_assets_allocation()
+    make_assets_allocation(portfolio)
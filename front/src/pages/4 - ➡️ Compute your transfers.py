@@ -1,11 +1,11 @@
 import streamlit as st
 
 from utils import (
+    apply_transfers,
+    fetch_portfolio,
     format_currency,
-    get_class_assets,
     load_asset_classes,
     make_request,
-    update_asset_value,
 )
 
 
@@ -94,9 +94,12 @@ def show_results(transfers: dict):
     show_class_rates(class_rates)
 
     st.header("Asset transfers")
+    assets = fetch_portfolio()["assets"]
     for asset_class in load_asset_classes():
         class_assets = [
-            asset["name"] for asset in get_class_assets(asset_class)
+            asset["name"]
+            for asset in assets
+            if asset["class_name"] == asset_class
         ]
         class_asset_transfers = [
             asset_transfer
@@ -108,9 +111,7 @@ def show_results(transfers: dict):
 
 
 def update_values(asset_transfers: list[dict]):
-    for asset in asset_transfers:
-        update_asset_value(asset["asset_name"], asset["new_value"])
-    st.success("Assets values updated", icon="✅")
+    apply_transfers(asset_transfers)
 
 
 total_amount = choose_amount_module()
@@ -1,10 +1,15 @@
 import json
+import time
 import babel.numbers
 import requests
 import streamlit as st
 import unidecode
 import yaml
 
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 
 with open("/conf/project_config.yml", "r") as f:
     PROJECT_CONFIG = yaml.safe_load(f)
@@ -18,11 +23,83 @@ def format_currency(value: float) -> str:
     )
 
 
+API_URL = "http://api:8000"
+# Seconds to connect to and to wait for the API, solving can take a while
+REQUEST_TIMEOUT = (3.05, 60)
+# Seconds a GET response is reused for without asking the API, when no
+# write went through the app
+CACHE_TTL = 60
+
+
+@st.experimental_singleton
+def get_http_session() -> requests.Session:
+    # Keep-alive connections shared by every script run
+    session = requests.Session()
+    retries = Retry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=[502, 503, 504],
+    )
+    adapter = HTTPAdapter(pool_maxsize=20, max_retries=retries)
+    session.mount("http://", adapter)
+    # Cookies are passed with each request, none should leak between users
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+def invalidate_cache():
+    # Kept responses are revalidated with their ETag before being reused
+    st.session_state["generation"] = st.session_state.get("generation", 0) + 1
+
+
+def conditional_get(
+    endpoint: str, params: dict | None, cookies: dict
+) -> requests.Response:
+    # Responses are kept for the session and reused without a request until
+    # a write goes through the app or CACHE_TTL runs out. Past that, the
+    # API answers 304 and sends no body while their ETag is still current
+    responses = st.session_state.setdefault("responses", {})
+    generation = st.session_state.get("generation", 0)
+    key = (endpoint, json.dumps(params, sort_keys=True))
+    cached = responses.get(key)
+    if (
+        cached is not None
+        and cached["generation"] == generation
+        and time.monotonic() - cached["date"] < CACHE_TTL
+    ):
+        return cached["response"]
+
+    headers = (
+        {"If-None-Match": cached["response"].headers["ETag"]}
+        if cached is not None and "ETag" in cached["response"].headers
+        else {}
+    )
+    response = get_http_session().get(
+        f"{API_URL}/{endpoint}",
+        params=params,
+        cookies=cookies,
+        headers=headers,
+        timeout=REQUEST_TIMEOUT,
+    )
+    if response.status_code == 304 and cached is not None:
+        response = cached["response"]
+    if response.ok:
+        responses[key] = {
+            "response": response,
+            "generation": generation,
+            "date": time.monotonic(),
+        }
+    else:
+        # Errors are not worth reusing, fetch again on the next run
+        responses.pop(key, None)
+    return response
+
+
 def make_request(
     endpoint: str, method: str = "GET", data: dict | None = None
 ) -> requests.Response:
 
-    url = f"http://api:8000/{endpoint}"
+    url = f"{API_URL}/{endpoint}"
 
     if not st.session_state.get("session_id"):
         # session_id = random.getrandbits(128)
@@ -32,21 +109,31 @@ def make_request(
     else:
         cookies = {"session_id": st.session_state.get("session_id")}
 
+    http_session = get_http_session()
+
     if method == "GET":
-        response = requests.get(url, cookies=cookies, params=data)
+        return conditional_get(endpoint, data, cookies)
 
     elif method == "PUT":
-        response = requests.put(url, json=data, cookies=cookies)
+        response = http_session.put(
+            url, json=data, cookies=cookies, timeout=REQUEST_TIMEOUT
+        )
 
     elif method == "DELETE":
-        response = requests.delete(url, cookies=cookies)
+        response = http_session.delete(
+            url, cookies=cookies, timeout=REQUEST_TIMEOUT
+        )
 
     elif method == "POST":
-        response = requests.post(url, json=data, cookies=cookies)
+        response = http_session.post(
+            url, json=data, cookies=cookies, timeout=REQUEST_TIMEOUT
+        )
 
     else:
         raise Exception("Invalid method")
 
+    # Every write may change what the kept reads returned
+    invalidate_cache()
     return response
 
 
@@ -59,6 +146,52 @@ def fetch_assets() -> list[dict]:
     return assets["assets"]
 
 
+def fetch_assets_summary() -> dict:
+    endpoint = "assets/summary"
+
+    response = make_request(endpoint)
+
+    return response.json()
+
+
+def sync_documents() -> dict[str, dict]:
+    # Local copy of the session documents by collection and id, only the
+    # documents changed since the last sync are sent by the API
+    endpoint = "changes/"
+    synced = st.session_state.get("synced", {"version": 0})
+
+    response = make_request(endpoint, data={"since": synced["version"]})
+    changes = response.json()
+
+    if changes["reset"]:
+        synced = {"version": 0, "documents": {}}
+    for collection, documents in changes["updated"].items():
+        local = synced["documents"].setdefault(collection, {})
+        for document in documents:
+            local[document["_id"]["$oid"]] = document
+    for collection, document_ids in changes["deleted"].items():
+        local = synced["documents"].setdefault(collection, {})
+        for document_id in document_ids:
+            local.pop(document_id["$oid"], None)
+    synced["version"] = changes["version"]
+
+    st.session_state["synced"] = synced
+    return synced["documents"]
+
+
+def fetch_portfolio() -> dict:
+    documents = sync_documents()
+
+    return {
+        "assets": list(documents["assets"].values()),
+        "allocation": {
+            statement["object_name"]: statement
+            for statement in documents["allocation"].values()
+        },
+        "constraints": list(documents["constraints"].values()),
+    }
+
+
 def load_asset_classes() -> list[str]:
     return PROJECT_CONFIG.get("config", {}).get("asset_classes")
 
@@ -106,6 +239,26 @@ def update_asset_value(asset_name: str, asset_value: float):
         st.error("Error updating asset", icon="❌")
 
 
+def apply_transfers(asset_transfers: list[dict]):
+    endpoint = "optimization/apply"
+    data = {
+        "asset_transfers": [
+            {
+                "asset_name": transfer["asset_name"],
+                "new_value": transfer["new_value"],
+            }
+            for transfer in asset_transfers
+        ]
+    }
+
+    r = make_request(endpoint, method="POST", data=data)
+
+    if r.ok:
+        st.success("Assets values updated", icon="✅")
+    else:
+        st.error("Error updating assets", icon="❌")
+
+
 def delete_asset(asset_name: str):
     endpoint = f"assets/{asset_name}"
 
@@ -117,13 +270,14 @@ def delete_asset(asset_name: str):
         st.error("Error deleting asset!", icon="❌")
 
 
-def export_data():
-    endpoint = f"mongo/export/"
+def export_data() -> bytes | None:
+    endpoint = "mongo/export"
 
-    r = make_request(endpoint, method="GET")
+    r = make_request(endpoint, method="GET", data={"compress": True})
 
     if r.ok:
-        return json.dumps(r.json(), indent=4)
+        # Already a JSON document, handed over to the download as is
+        return r.content
     else:
         st.error("Error exporting data!", icon="❌")
 
@@ -135,6 +289,12 @@ def import_data(data: str):
     r = make_request(endpoint, method="POST", data=data)
 
     if r.ok:
-        st.success("Data imported", icon="✅")
+        counts = r.json()["counts"]
+        st.success(
+            f"Data imported: {counts['assets']} assets, "
+            f"{counts['allocation']} allocation statements and "
+            f"{counts['constraints']} constraints",
+            icon="✅",
+        )
     else:
         st.error("Error importing data!", icon="❌")